@@ -0,0 +1,137 @@
+import os
+import re
+import json
+from .models import Publication
+from .dedup import strip_accents
+
+NAME_SPLIT_RE = re.compile(r"[\s.,]+")
+
+# Break a name down into a normalised surname and list of forenames (or initials), ignoring case, accents and punctuation:
+def name_parts(name):
+    tokens = [token for token in NAME_SPLIT_RE.split(strip_accents(name).lower()) if token]
+    if not tokens:
+        return "", []
+    return tokens[-1], tokens[:-1]
+
+# Do two lists of forenames refer to the same person? e.g. ['p'] and ['priscilla'] do, ['paul'] and ['priscilla'] don't:
+def forenames_compatible(a, b):
+    for x, y in zip(a, b):
+        if x == y:
+            continue
+        if (len(x) == 1 or len(y) == 1) and x[0] == y[0]:
+            continue
+        return False
+    return True
+
+# How complete a variant is, for picking the canonical name (full forenames beat initials, then proper case and accents win,
+# but names with stray institution text from the source are avoided):
+def name_fullness(name):
+    surname, forenames = name_parts(name)
+    return (
+        '(' not in name,
+        sum(1 for f in forenames if len(f) > 1),
+        len(forenames),
+        sum(1 for word in name.split() if word[:1].isupper() and not word.isupper()),
+        sum(1 for c in name if ord(c) > 127),
+        len(name),
+    )
+
+# Merge two lists of forenames, keeping the fullest form at each position (e.g. ['p', 'j'] and ['paul'] give ['paul', 'j']).
+# A name is compatible with every variant of an author exactly when it's compatible with the merge of their forenames:
+def merge_forenames(a, b):
+    merged = [y if len(y) > len(x) else x for x, y in zip(a, b)]
+    return merged + (a[len(b):] if len(a) > len(b) else b[len(a):])
+
+# Maps name variants to canonical author IDs. Exact variants are looked up in a dict, and new variants are matched
+# via normalised full-name and surname+initial keys, checking the forenames against each candidate author's merged
+# forenames, so each lookup is O(1). An ambiguous match (i.e. more than one compatible author) gets a new author, as the
+# sources only give institutions per paper, not per author, so they can't be used to tell authors apart.
+# The index is persisted between runs and extended as new names turn up, so author IDs are stable.
+class AuthorIndex:
+    def __init__(self):
+        self.authors = {}
+        self.variants = {}
+        self.forenames = {}
+        self.full_keys = {}
+        self.initial_keys = {}
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for author_id, author in json.load(f)['authors'].items():
+                    index.authors[author_id] = { 'name': author['name'], 'variants': [], 'institutions': set(author['institutions']) }
+                    for variant in author['variants']:
+                        index._add_variant(author_id, variant)
+        return index
+
+    def save(self, path):
+        data = { 'authors': {
+            author_id: { 'name': author['name'], 'variants': sorted(author['variants']), 'institutions': sorted(author['institutions']) }
+            for author_id, author in self.authors.items()
+        }}
+        content = json.dumps(data, indent=1, ensure_ascii=False)
+        # Only rewrite the file if there's something new:
+        if os.path.exists(path):
+            with open(path) as f:
+                if f.read() == content:
+                    return
+        with open(f"{path}.tmp", 'w') as f:
+            f.write(content)
+        os.replace(f"{path}.tmp", path)
+
+    def _add_variant(self, author_id, name):
+        author = self.authors[author_id]
+        author['variants'].append(name)
+        if name_fullness(name) > name_fullness(author['name']):
+            author['name'] = name
+        self.variants[name] = author_id
+        surname, forenames = name_parts(name)
+        self.forenames[author_id] = merge_forenames(self.forenames.get(author_id, []), forenames)
+        self.full_keys.setdefault(f"{surname}|{' '.join(forenames)}", author_id)
+        initial_key = f"{surname}|{forenames[0][0] if forenames else ''}"
+        ids = self.initial_keys.setdefault(initial_key, [])
+        if author_id not in ids:
+            ids.append(author_id)
+
+    # Find an existing author this new variant could belong to:
+    def _match(self, name):
+        surname, forenames = name_parts(name)
+        author_id = self.full_keys.get(f"{surname}|{' '.join(forenames)}")
+        if author_id:
+            return author_id
+        candidates = [
+            author_id for author_id in self.initial_keys.get(f"{surname}|{forenames[0][0] if forenames else ''}", [])
+            if forenames_compatible(forenames, self.forenames[author_id])
+        ]
+        if len(candidates) == 1:
+            return candidates[0]
+        return None
+
+    # Get the ID for a creator name, adding it to the index if it's new.
+    # The institutions (of the paper) are recorded against the author, but not used for matching:
+    def identify(self, name, institutions=()):
+        author_id = self.variants.get(name)
+        if author_id is None:
+            author_id = self._match(name)
+            if author_id is None:
+                author_id = f"A{len(self.authors) + 1:05d}"
+                self.authors[author_id] = { 'name': name, 'variants': [], 'institutions': set() }
+            self._add_variant(author_id, name)
+        self.authors[author_id]['institutions'].update(institutions)
+        return author_id
+
+    def canonical_name(self, author_id):
+        return self.authors[author_id]['name']
+
+    # Record the author IDs for a publication's creators:
+    def apply(self, pub: Publication):
+        pub.creator_ids = [self.identify(creator, pub.institutions) for creator in (pub.creators or [])]
+        return pub
+
+# The creator names to use for a publication, i.e. the canonical names if there's an author index:
+def get_creator_names(pub: Publication, authors=None):
+    if authors and pub.creator_ids:
+        return [authors.canonical_name(author_id) for author_id in pub.creator_ids]
+    return pub.creators or []
@@ -0,0 +1,423 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import hashlib
+import shutil
+import argparse
+import logging
+import platform
+import tempfile
+import datetime
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# Roughly how many records each source has in the real corpus, i.e. scale 1:
+PHAIDRA_COUNTS = {
+    2004: 32, 2005: 16, 2006: 29, 2007: 40, 2008: 50, 2009: 31, 2010: 50, 2011: 52, 2012: 59,
+    2013: 61, 2014: 86, 2015: 79, 2016: 75, 2017: 44, 2018: 43, 2019: 99, 2021: 88,
+}
+ZOTERO_COUNT = 130
+IDEALS_COUNT = 119
+GHENT_COUNT = 220
+# Sizes of the pools the synthetic creators and institutions are drawn from, at scale 1:
+AUTHOR_POOL = 2000
+INSTITUTION_POOL = 300
+
+WORDS = """
+access archive archives archival authenticity born-digital bit-level capture case collection collections community
+curation data dataset datasets description digital discovery email emulation file format formats framework fixity
+identifiers infrastructure integrity institutional interoperability legacy library lessons long-term management
+media metadata migration model models national network object objects obsolescence open persistent planning policy
+practice preservation preserving project provenance registry repositories repository research risk risks scalable
+science services software storage strategies strategy study sustainability sustainable systems technical tools
+trust trustworthy validation video web workflow workflows
+""".split()
+TITLE_STARTS = ["Towards", "Lessons from", "A study of", "Preserving", "Scaling up", "Rethinking", "Automating", "Measuring", "Building", "Evaluating"]
+FIRST_NAMES = """
+Aino Alex Ana Andrea Angela Anna Barbara Ben Carl Carla Chen Chris Clara Daniel David Diana Eld Elena Emma Eva
+Felix Hannah Helen Ian Ines Jan Javier Jean Jenny John Jose Julia Karin Kate Klaus Laura Lea Li Luis Maria Mark
+Martin Mia Michael Nancy Nina Olivier Paul Pedro Peter Rachel Sara Sophie Stephen Tim Tom Ulla Wei Yuki
+""".split()
+SURNAMES = """
+Abrams Andersen Becker Borg Brown Caplan Chou Costa Daigle Davis Dubois Edsen Faria Fischer Garcia Green Hansen
+Huber Jackson Kejser Kim Lee Lindlar Lopes Martin Massol Meyer Moreau Morrissey Muller Nelson Novak Oury Phillips
+Rauber Rechert Rosenthal Santos Schmidt Silva Smith Suzuki Tanner Thomson Walters Wang Weber Wheatley Wilson Zierau
+""".split()
+# Syllables for made-up words (e.g. project and tool names), as real titles have a long tail of rare words:
+SYLLABLES = "ar be ca do el fi go ha in jo ka lu mo ne or pa qui ro su ta ve wi xa zo".split()
+PLACES = "Vienna Lisbon Toronto Singapore Melbourne Chapel-Hill Beijing Amsterdam Glasgow Urbana Ghent".split()
+
+# Deterministic random content, so runs at the same scale are comparable:
+class SyntheticCorpus:
+    def __init__(self, scale, seed=42):
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.titles = set()
+        n_authors = int(AUTHOR_POOL * scale)
+        self.authors = [(self.rng.choice(FIRST_NAMES), f"{self.rng.choice(SURNAMES)}{'' if i < len(SURNAMES) else i}") for i in range(n_authors)]
+        # Some authors are far more prolific than others:
+        self.author_weights = [1 / (i + 1) ** 0.8 for i in range(n_authors)]
+        self.institutions = [f"University of {self.rng.choice(PLACES)} {i}" for i in range(int(INSTITUTION_POOL * scale))]
+
+    def count(self, n):
+        return max(1, int(n * self.scale))
+
+    def words(self, n):
+        return " ".join(self.rng.choice(WORDS) for _ in range(n))
+
+    # A new title, that isn't the same as any other:
+    def title(self):
+        while True:
+            title = f"{self.rng.choice(TITLE_STARTS)} {self.words(self.rng.randint(2, 6))} {self.rare_word()} {self.words(self.rng.randint(1, 3))}"
+            if title.lower() not in self.titles:
+                self.titles.add(title.lower())
+                return title
+
+    def rare_word(self):
+        return "".join(self.rng.choice(SYLLABLES) for _ in range(self.rng.randint(2, 4))).capitalize()
+
+    def abstract(self):
+        return ". ".join(self.words(self.rng.randint(8, 20)).capitalize() for _ in range(self.rng.randint(4, 10))) + "."
+
+    def creators(self):
+        return self.rng.choices(self.authors, weights=self.author_weights, k=self.rng.randint(1, 5))
+
+    def keywords(self):
+        return self.rng.sample(WORDS, self.rng.randint(2, 6))
+
+    def write_phaidra(self, output_path, year):
+        with open(output_path, 'w') as f:
+            for i in range(self.count(PHAIDRA_COUNTS[year])):
+                title = self.title()
+                # Exercise the title cleanup and type rules:
+                if self.rng.random() < 0.3:
+                    title = f"{title}: Paper - iPRES {year} - {self.rng.choice(PLACES)}"
+                abstract = self.rng.choice(['x', 'Lightning Talk', f"In this poster, {self.abstract()}"]) if self.rng.random() < 0.1 else self.abstract()
+                pid = f"o:{year}{i:06d}"
+                doc = {
+                    '__source_name': 'iPRES',
+                    '__year': year,
+                    'pid': pid,
+                    'dc_title': [title],
+                    'dc_description': [abstract],
+                    'dc_language': ['eng'],
+                    'dc_format': ['application/pdf'],
+                    'dc_creator': [f"{last}, {first} ({self.rng.choice(self.institutions)})" for first, last in self.creators()],
+                    'dc_identifier': [f"hdl:11353/10.{pid}"],
+                    'keyword_suggest': [",".join(self.keywords())],
+                    'dc_license': ['CC BY 4.0'],
+                    'size': str(self.rng.randint(100000, 5000000)),
+                }
+                f.write(f"{json.dumps(doc)}\n")
+
+    # The Zotero export, along with the EventsAir agenda and the mapping between the two:
+    def write_ipres2022(self, output_dir):
+        types = ["Long Paper", "Short Paper", "Panel", "Workshop", "Poster"]
+        osf_files = ["Long-Paper", "Slides", "Recording", "Collaborative-Notes", "Biography"]
+        agenda = []
+        mapping = []
+        counter = 0
+        with open(os.path.join(output_dir, 'ipres2022.zotero.jsonl'), 'w') as f:
+            for i in range(self.count(ZOTERO_COUNT)):
+                osf_id = f"s{i:05d}"
+                key = f"P{i:07d}"
+                type = self.rng.choice(types)
+                title = self.title()
+                creators = self.creators()
+                item = {
+                    'key': key,
+                    'links': { 'self': { 'href': f"https://api.zotero.org/groups/1/items/{key}" } },
+                    'publication_type': type.split(" ")[-1],
+                    'data': {
+                        'key': key,
+                        'itemType': 'journalArticle',
+                        'title': f"{title}_20220914",
+                        'creators': [{ 'creatorType': 'author', 'firstName': first, 'lastName': last } for first, last in creators],
+                        'abstractNote': f"{type} \n    Recording: https://youtu.be/{osf_id}",
+                        'language': 'en',
+                        'rights': '',
+                    },
+                }
+                f.write(f"{json.dumps(item)}\n")
+                attachment = {
+                    'key': f"A{i:07d}",
+                    'links': { 'self': { 'href': f"https://api.zotero.org/groups/1/items/A{i:07d}" } },
+                    'data': {
+                        'key': f"A{i:07d}",
+                        'itemType': 'attachment',
+                        'parentItem': key,
+                        'linkMode': 'imported_url',
+                        'title': 'Snapshot',
+                        'osf_id': osf_id,
+                        'landing_page': f"https://osf.io/{osf_id}/",
+                        'osf_files': { 'data': [
+                            { 'attributes': { 'name': f"iPres22_{kind}_{title.replace(' ', '-')}.pdf" }, 'links': { 'download': f"https://osf.io/download/{osf_id}{j}/" } }
+                            for j, kind in enumerate(self.rng.sample(osf_files, 3))
+                        ]},
+                    },
+                }
+                f.write(f"{json.dumps(attachment)}\n")
+                # Most have an EventsAir entry, with one entry per speaker:
+                if self.rng.random() < 0.9:
+                    speakers = []
+                    for first, last in creators[:2]:
+                        counter += 1
+                        mapping.append({ 'ea_id': f"iPRES:ea2022:{counter}", 'osf_id': f"iPRES:osf:{osf_id}" })
+                        speakers.append({
+                            'PresenationTitle': f"{type}: {title}",
+                            'FirstName': first,
+                            'LastName': last,
+                            'Organization': self.rng.choice(self.institutions),
+                            'Documents': [
+                                { 'Name': 'Abstract', 'PlainText': self.abstract() },
+                                { 'Name': 'Keywords', 'PlainText': ", ".join(self.keywords()) },
+                                { 'Name': 'Proposal Document', 'Url': f"https://example.org/proposals/{osf_id}.pdf" },
+                            ],
+                        })
+                    agenda.append({ 'Name': f"{type}: {title}", 'Speakers': speakers })
+                else:
+                    agenda.append({ 'Name': 'Break', 'Speakers': [] })
+        with open(os.path.join(output_dir, 'ipres2022.eventsair.json'), 'w') as f:
+            json.dump({ 'AgendaData': { 'TrackHeadings': [], 'AgendaItems': agenda } }, f)
+        with open(os.path.join(output_dir, 'ipres2022.eventsair-osf-mapping.csv'), 'w', newline='') as f:
+            writer = csv.DictWriter(f, ['ea_id', 'osf_id'])
+            writer.writeheader()
+            writer.writerows(mapping)
+
+    def write_ideals(self, output_path):
+        with open(output_path, 'w') as f:
+            for i in range(self.count(IDEALS_COUNT)):
+                title = self.title()
+                doc = {
+                    'title': [title],
+                    'subject': self.keywords(),
+                    'creator': [f"{last}, {first}" for first, last in self.creators()],
+                    'description': [self.abstract()],
+                    'language': ['en'],
+                    'source_url': f"https://hdl.handle.net/2142/{i}",
+                    'pdf_url': f"https://www.ideals.illinois.edu/items/{i}/data.pdf",
+                }
+                f.write(f"{json.dumps(doc)}\n")
+                # Some have separate presentation records:
+                if self.rng.random() < 0.2:
+                    doc['title'] = [f"{title} [presentation]"]
+                    doc['source_url'] = f"https://hdl.handle.net/2142/p{i}"
+                    f.write(f"{json.dumps(doc)}\n")
+
+    def write_ghent(self, output_path):
+        fields = [
+            'ProgramCode', 'Title', 'AcceptedFormat', 'CompetencyFrameworkBestMatch', 'ConferenceTheme', 'Abstract_MARKDOWN',
+            'Authors', 'PublicationLocation', 'PosterImageLocation', 'PresentationDate', 'PresentationStart',
+            'PresentationMaterials', 'SessionVideoLocation', 'CollaborativeNotesLocation', 'License',
+        ]
+        with open(output_path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.DictWriter(f, fields)
+            writer.writeheader()
+            for i in range(self.count(GHENT_COUNT)):
+                format = self.rng.choice(['Paper', 'Poster', 'Panel', 'Workshop'])
+                writer.writerow({
+                    'ProgramCode': f"indico{i:05d}",
+                    'Title': self.title(),
+                    'AcceptedFormat': format,
+                    'CompetencyFrameworkBestMatch': 'Information Technology for DP',
+                    'ConferenceTheme': self.rng.choice(['Start 2 preserve', 'Mind the gap', 'Spring into action']),
+                    'Abstract_MARKDOWN': self.abstract(),
+                    'Authors': ", ".join(f"{first} {last}" for first, last in self.creators()),
+                    'PublicationLocation': f"https://ipres2024.pubpub.org/pub/{i:08d}/",
+                    'PosterImageLocation': f"https://example.org/posters/{i}.pdf" if format == 'Poster' else '',
+                    'PresentationDate': '2024-09-18',
+                    'PresentationStart': f"{self.rng.randint(9, 17):02d}:00",
+                    'PresentationMaterials': '',
+                    'SessionVideoLocation': '',
+                    'CollaborativeNotesLocation': f"https://docs.google.com/document/d/{i}",
+                    'License': 'Creative Commons Attribution 4.0 (CC-BY-4.0)',
+                })
+                # Non-publication rows get skipped:
+                if self.rng.random() < 0.5:
+                    writer.writerow({ 'ProgramCode': f"break{i:05d}", 'Title': 'Coffee break' })
+
+    # Text for a document, a page at a time:
+    def document_text(self):
+        return [" ".join(self.abstract() for _ in range(4)) for _ in range(self.rng.randint(2, 8))]
+
+    # Fill a full-text store with extracted text for the documents of the merged records, as if they'd been harvested
+    # (there's nothing to download offline, but it's the loading into the DB that gets benchmarked):
+    def write_fulltext(self, store_dir, merged_jsonl):
+        from .fulltext import FulltextStore
+        store = FulltextStore(store_dir)
+        with open(merged_jsonl) as f:
+            urls = set(json.loads(line)['document_url'] for line in f)
+        for url in sorted(url for url in urls if url):
+            pages = self.document_text()
+            text = "\n\n".join(pages)
+            sha256 = hashlib.sha256(url.encode('utf-8')).hexdigest()
+            store.add_document(url, { 'sha256': sha256, 'size': len(text), 'content_type': 'application/pdf', 'fetched_at': 0, 'source_size': None })
+            store.texts[sha256] = { 'pages': len(pages), 'chars': len(text) }
+            os.makedirs(os.path.dirname(store.text_path(sha256)), exist_ok=True)
+            with open(store.text_path(sha256), 'w', encoding='utf-8') as out:
+                out.write(text)
+        store.save()
+
+    # Write out a complete set of raw source files:
+    def write_sources(self, raw_dir):
+        os.makedirs(raw_dir, exist_ok=True)
+        for year in PHAIDRA_COUNTS:
+            self.write_phaidra(os.path.join(raw_dir, f"ipres{year}.phaidra.jsonl"), year)
+        self.write_ipres2022(raw_dir)
+        self.write_ideals(os.path.join(raw_dir, 'ipres2023.ideals.jsonl'))
+        self.write_ghent(os.path.join(raw_dir, 'ipres2024.ghent.csv'))
+
+
+# Set-up to run before each run of a stage, removing its caches or previous outputs, so repeats aren't faster than the first run:
+def clear(*paths):
+    def setup():
+        for path in paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.exists(path):
+                os.remove(path)
+    return setup
+
+# The pipeline stages, as (name, module arguments, set-up to run before each run, if any) with paths relative to the
+# work folder, run in this order:
+def get_stages(work_dir, jobs, corpus):
+    w = lambda path: os.path.join(work_dir, path)
+    def setup_fulltext():
+        if not os.path.exists(w('fulltext')):
+            corpus.write_fulltext(w('fulltext'), w('merged.jsonl'))
+    merge_args = [
+        'dppi.merger', '--jobs', str(jobs), '--cache-dir', w('merge-cache'), '--dedup',
+        '--awindex-prefix', w('merged.awindex'), '--path-index', w('merged.paths.json'), '--authors', w('authors.json'),
+        w('raw'), w('merged'),
+    ]
+    return [
+        # The first merge starts from scratch, filling the shard cache, and the second shows the cost when nothing has changed:
+        ('merge', merge_args, clear(w('merge-cache'), w('authors.json'))),
+        ('merge_cached', merge_args, None),
+        ('dbmaker', ['dppi.dbmaker', '--authors', w('authors.json'), w('practice.db'), w('merged.jsonl')], None),
+        ('dbmaker_fulltext', ['dppi.dbmaker', '--authors', w('authors.json'), '--fulltext', w('fulltext'), w('practice.db'), w('merged.jsonl')], setup_fulltext),
+        # Unchanged pages aren't rewritten, so each run starts from an empty site:
+        ('pubmaker', ['dppi.pubmaker', '--jobs', str(jobs), w('merged.jsonl'), w('site')], clear(w('site'))),
+        ('graph_gen', ['dppi.graph_gen', '--authors', w('authors.json'), w('merged.jsonl'), w('graph.json')], None),
+        ('graph_analytics', ['dppi.graph_analytics', '--authors', w('authors.json'), w('merged.jsonl'), w('graph-analytics.json')], None),
+        ('search', ['dppi.search', 'build', '--authors', w('authors.json'), w('merged.jsonl'), w('search.idx')], None),
+    ]
+
+# Run a stage in a subprocess, timing it, and getting its peak memory use from wait4():
+def run_stage(module_args, log_path):
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(log_path, 'a') as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, '-m'] + module_args, cwd=repo_dir, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+    # Let Popen know the process has been reaped:
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        'seconds': elapsed,
+        'cpu_seconds': usage.ru_utime + usage.ru_stime,
+        'peak_rss_mb': usage.ru_maxrss / 1024, # ru_maxrss is in KB on Linux
+        'exit_code': proc.returncode,
+    }
+
+# Generate the corpus at the given scale, and run each stage on it, keeping the best of `repeat` runs:
+def run_scale(scale, work_dir, jobs=1, repeat=1):
+    logger.info(f"Generating synthetic sources at scale {scale}...")
+    start = time.perf_counter()
+    corpus = SyntheticCorpus(scale)
+    corpus.write_sources(os.path.join(work_dir, 'raw'))
+    logger.info(f"Generated in {time.perf_counter() - start:.1f}s.")
+    stages = {}
+    records = None
+    for name, module_args, setup in get_stages(work_dir, jobs, corpus):
+        best = None
+        for _ in range(repeat):
+            if setup:
+                setup()
+            result = run_stage(module_args, os.path.join(work_dir, f"{name}.log"))
+            if result['exit_code'] != 0:
+                raise Exception(f"Stage {name} failed at scale {scale}! See {work_dir}/{name}.log")
+            if best is None or result['seconds'] < best['seconds']:
+                best = result
+        if records is None:
+            with open(os.path.join(work_dir, 'merged.jsonl')) as f:
+                records = sum(1 for _ in f)
+        best['records_per_second'] = records / best['seconds']
+        logger.info(f"Scale {scale} {name}: {best['seconds']:.2f}s, {best['records_per_second']:.0f} records/s, peak RSS {best['peak_rss_mb']:.0f}MB")
+        stages[name] = best
+    return { 'scale': scale, 'records': records, 'stages': stages }
+
+# Compare the results against a baseline, returning a list of regressions.
+# Small absolute differences are ignored, as short stages are noisy:
+def compare_results(results, baseline, tolerance=0.2, min_seconds=0.1):
+    regressions = []
+    baseline_runs = { run['scale']: run for run in baseline['runs'] }
+    for run in results['runs']:
+        old_run = baseline_runs.get(run['scale'])
+        if not old_run:
+            continue
+        for name, stage in run['stages'].items():
+            old = old_run['stages'].get(name)
+            if not old:
+                continue
+            for metric, min_diff in [('seconds', min_seconds), ('peak_rss_mb', 1)]:
+                if stage[metric] > old[metric] * (1 + tolerance) and stage[metric] - old[metric] > min_diff:
+                    regressions.append(f"Scale {run['scale']} {name} {metric}: {old[metric]:.2f} -> {stage[metric]:.2f}")
+    return regressions
+
+
+# Main for CLI
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # Set up a simpler argument parser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', dest='output_json', default='benchmark-results.json', help="Where to write the results (default: benchmark-results.json).")
+    parser.add_argument('--scales', type=float, nargs='+', default=[1], help="Corpus scales to run at, relative to the real corpus (default: 1).")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of worker processes for the stages that support them.")
+    parser.add_argument('--repeat', type=int, default=1, help="Run each stage this many times, and keep the fastest.")
+    parser.add_argument('--work-dir', help="Folder to generate the corpus and outputs in (default: a temporary folder, removed afterwards).")
+    parser.add_argument('--baseline', help="Results file to compare against. Exits with an error if any stage is slower or uses more memory than this.")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="How much worse than the baseline a stage can be before it counts as a regression (default: 0.2, i.e. 20%%).")
+
+    args = parser.parse_args()
+
+    results = {
+        'created': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'jobs': args.jobs,
+        'runs': [],
+    }
+    for scale in args.scales:
+        scale = int(scale) if scale == int(scale) else scale
+        if args.work_dir:
+            work_dir = os.path.join(args.work_dir, f"scale-{scale}")
+            shutil.rmtree(work_dir, ignore_errors=True)
+            os.makedirs(work_dir)
+        else:
+            work_dir = tempfile.mkdtemp(prefix=f"dppi-benchmark-{scale}-")
+        try:
+            results['runs'].append(run_scale(scale, work_dir, jobs=args.jobs, repeat=args.repeat))
+        finally:
+            if not args.work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output_json, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.baseline:
+        if not os.path.exists(args.baseline):
+            logger.warning(f"No baseline found at {args.baseline}, so not comparing. Copy {args.output_json} there to make it the baseline.")
+        else:
+            with open(args.baseline) as f:
+                regressions = compare_results(results, json.load(f), tolerance=args.tolerance)
+            for regression in regressions:
+                logger.error(f"Regression! {regression}")
+            if regressions:
+                sys.exit(1)
+            logger.info("No regressions compared to the baseline.")
@@ -0,0 +1,260 @@
+import os
+import json
+import sqlite3
+import argparse
+import logging
+from typing import get_args
+from .models import Publication, read_publications_jsonl
+from .authors import AuthorIndex, get_creator_names
+from .fulltext import FulltextStore
+
+logger = logging.getLogger(__name__)
+
+# Columns that should come first, in this order, with the rest following in model order:
+LEADING_COLUMNS = ['source_name', 'year', 'title', 'type', 'landing_page_url', 'creators']
+# Columns to include in the full-text search index:
+FTS_COLUMNS = ['title', 'creators', 'abstract', 'keywords', 'institutions', 'type']
+# Columns to index for filtering and faceting:
+INDEXED_COLUMNS = ['year', 'type', 'source_name']
+# Array columns to normalise out into lookup tables, with join tables keyed by publication rowid:
+LINKED_COLUMNS = ['creators', 'institutions', 'keywords']
+# Number of top keywords to keep for each year in the summary tables:
+TOP_KEYWORDS_PER_YEAR = 25
+# Number of rows to send to SQLite per executemany call:
+BATCH_SIZE = 1000
+
+# Work out the column order and SQLite types from the Publication schema:
+def get_columns():
+    fields = Publication.model_fields
+    names = LEADING_COLUMNS + [name for name in fields if name not in LEADING_COLUMNS]
+    columns = []
+    for name in names:
+        annotation = fields[name].annotation
+        if annotation is int or int in get_args(annotation):
+            columns.append((name, 'INTEGER'))
+        else:
+            columns.append((name, 'TEXT'))
+    return columns
+
+def create_schema(conn, columns):
+    column_defs = ",\n".join(f"   [{name}] {sql_type}" for name, sql_type in columns)
+    conn.execute(f"CREATE TABLE [publications] (\n{column_defs}\n)")
+    # Lookup and join tables for the array columns:
+    for name in LINKED_COLUMNS:
+        link_table, link_column = get_link_names(name)
+        conn.execute(f"CREATE TABLE [{name}] (\n   [id] INTEGER PRIMARY KEY,\n   [name] TEXT UNIQUE\n)")
+        if name == 'creators':
+            # The canonical author ID, if an author index was used:
+            conn.execute("ALTER TABLE [creators] ADD COLUMN [author_id] TEXT")
+        conn.execute(f"""CREATE TABLE [{link_table}] (
+   [publication_id] INTEGER,
+   [{link_column}] INTEGER REFERENCES [{name}]([id]),
+   [position] INTEGER,
+   PRIMARY KEY ([publication_id], [position])
+) WITHOUT ROWID""")
+
+# e.g. 'creators' => ('publication_creators', 'creator_id')
+def get_link_names(name):
+    return f"publication_{name}", f"{name[:-1]}_id"
+
+# Assigns ids to the distinct values in an array column, and records the links to them:
+class LinkedValues:
+    def __init__(self, name):
+        self.name = name
+        self.ids = {}
+        self.links = []
+
+    def add(self, publication_id, values):
+        for position, value in enumerate(values or []):
+            value_id = self.ids.get(value)
+            if value_id is None:
+                value_id = len(self.ids) + 1
+                self.ids[value] = value_id
+            self.links.append((publication_id, value_id, position))
+
+    def save(self, conn):
+        link_table, link_column = get_link_names(self.name)
+        conn.executemany(f"INSERT INTO [{self.name}] ([id], [name]) VALUES (?, ?)",
+                         ((value_id, value) for value, value_id in self.ids.items()))
+        conn.executemany(f"INSERT INTO [{link_table}] ([publication_id], [{link_column}], [position]) VALUES (?, ?, ?)",
+                         self.links)
+
+# Convert a record to a row, with lists stored as JSON (as sqlite-utils does, so Datasette's _facet_array works):
+def to_row(data, column_names):
+    row = []
+    for name in column_names:
+        value = data[name]
+        if isinstance(value, (list, dict)):
+            value = json.dumps(value, ensure_ascii=False)
+        row.append(value)
+    return row
+
+# Load the records, setting the rowid explicitly so the join tables can refer to it.
+# With an author index, the creators are linked by their canonical names, so name variants are counted together:
+def load_publications(conn, pubs, column_names, batch_size=BATCH_SIZE, authors=None):
+    placeholders = ", ".join("?" for _ in column_names)
+    sql = f"INSERT INTO [publications] ([rowid], {', '.join(f'[{name}]' for name in column_names)}) VALUES (?, {placeholders})"
+    linked = { name: LinkedValues(name) for name in LINKED_COLUMNS }
+    count = 0
+    batch = []
+    for d in pubs:
+        count += 1
+        data = d.model_dump(mode='json')
+        batch.append([count] + to_row(data, column_names))
+        for name in LINKED_COLUMNS:
+            if name == 'creators':
+                linked[name].add(count, get_creator_names(d, authors))
+            else:
+                linked[name].add(count, data[name])
+        if len(batch) >= batch_size:
+            conn.executemany(sql, batch)
+            batch = []
+    if batch:
+        conn.executemany(sql, batch)
+    for name in LINKED_COLUMNS:
+        linked[name].save(conn)
+    if authors:
+        conn.executemany("UPDATE [creators] SET [author_id] = ? WHERE [name] = ?",
+                         ((author_id, author['name']) for author_id, author in authors.authors.items()))
+    return count
+
+# Set up the full-text index in the same form as `sqlite-utils enable-fts`, so Datasette picks it up, and populate it in bulk:
+def build_fts(conn):
+    fts_columns = ", ".join(f"[{name}]" for name in FTS_COLUMNS)
+    conn.execute(f"CREATE VIRTUAL TABLE [publications_fts] USING FTS5 (\n    {fts_columns},\n    content=[publications]\n)")
+    conn.execute("INSERT INTO [publications_fts] ([publications_fts]) VALUES ('rebuild')")
+    conn.execute("INSERT INTO [publications_fts] ([publications_fts]) VALUES ('optimize')")
+
+# Load the text extracted from each publication's document (if any) into a separate table, keyed by the publication rowid,
+# with its own full-text index, so searching the documents is optional and doesn't skew the ranking of the metadata search:
+def build_fulltext(conn, store):
+    conn.execute("""CREATE TABLE [publications_fulltext] (
+   [publication_id] INTEGER PRIMARY KEY REFERENCES [publications]([rowid]),
+   [sha256] TEXT,
+   [pages] INTEGER,
+   [text] TEXT
+)""")
+    def rows():
+        for publication_id, url in conn.execute("SELECT [rowid], [document_url] FROM [publications] WHERE [document_url] IS NOT NULL").fetchall():
+            result = store.get_text(url)
+            if result:
+                yield (publication_id, *result)
+    conn.executemany("INSERT INTO [publications_fulltext] ([publication_id], [sha256], [pages], [text]) VALUES (?, ?, ?, ?)", rows())
+    conn.execute("CREATE VIRTUAL TABLE [publications_fulltext_fts] USING FTS5 (\n    [text],\n    content=[publications_fulltext]\n)")
+    conn.execute("INSERT INTO [publications_fulltext_fts] ([publications_fulltext_fts]) VALUES ('rebuild')")
+    conn.execute("INSERT INTO [publications_fulltext_fts] ([publications_fulltext_fts]) VALUES ('optimize')")
+    return conn.execute("SELECT COUNT(*) FROM [publications_fulltext]").fetchone()[0]
+
+def build_indexes(conn):
+    for name in INDEXED_COLUMNS:
+        conn.execute(f"CREATE INDEX [idx_publications_{name}] ON [publications] ([{name}])")
+    # The join tables are keyed on publication, so also need an index for lookups by value:
+    for name in LINKED_COLUMNS:
+        link_table, link_column = get_link_names(name)
+        conn.execute(f"CREATE INDEX [idx_{link_table}_{link_column}] ON [{link_table}] ([{link_column}])")
+
+# Materialise the commonly-requested aggregates as small summary tables:
+SUMMARY_TABLES = {
+    'summary_by_year': """
+        SELECT [year], COUNT(*) AS [count]
+        FROM [publications] GROUP BY [year] ORDER BY [year]""",
+    'summary_by_type': """
+        SELECT [type], COUNT(*) AS [count]
+        FROM [publications] GROUP BY [type] ORDER BY [count] DESC, [type]""",
+    'summary_creators': """
+        SELECT c.[id] AS [creator_id], c.[name], COUNT(*) AS [count],
+            MIN(p.[year]) AS [first_year], MAX(p.[year]) AS [last_year]
+        FROM [publication_creators] pc
+        JOIN [creators] c ON c.[id] = pc.[creator_id]
+        JOIN [publications] p ON p.[rowid] = pc.[publication_id]
+        GROUP BY c.[id] ORDER BY [count] DESC, c.[name]""",
+    'summary_institutions': """
+        SELECT i.[id] AS [institution_id], i.[name], COUNT(*) AS [count],
+            MIN(p.[year]) AS [first_year], MAX(p.[year]) AS [last_year]
+        FROM [publication_institutions] pi
+        JOIN [institutions] i ON i.[id] = pi.[institution_id]
+        JOIN [publications] p ON p.[rowid] = pi.[publication_id]
+        GROUP BY i.[id] ORDER BY [count] DESC, i.[name]""",
+    'summary_keywords_by_year': f"""
+        SELECT [year], [rank], [keyword_id], [name], [count] FROM (
+            SELECT p.[year], k.[id] AS [keyword_id], k.[name], COUNT(*) AS [count],
+                ROW_NUMBER() OVER (PARTITION BY p.[year] ORDER BY COUNT(*) DESC, k.[name]) AS [rank]
+            FROM [publication_keywords] pk
+            JOIN [keywords] k ON k.[id] = pk.[keyword_id]
+            JOIN [publications] p ON p.[rowid] = pk.[publication_id]
+            GROUP BY p.[year], k.[id]
+        ) WHERE [rank] <= {TOP_KEYWORDS_PER_YEAR} ORDER BY [year], [rank]""",
+}
+
+# These are built in the same transaction as the main table, so they can never be out of step with it:
+def build_summary_tables(conn):
+    for name, query in SUMMARY_TABLES.items():
+        conn.execute(f"CREATE TABLE [{name}] AS {query}")
+    conn.execute("CREATE INDEX [idx_summary_keywords_by_year_year] ON [summary_keywords_by_year] ([year])")
+
+# Build the whole database from a stream of records.
+# This is written to a temporary file that replaces the output on success, so a failed build never leaves a partial DB behind
+# (and the temporary file is deleted if the build fails):
+def build_database(db_path, pubs, batch_size=BATCH_SIZE, authors=None, fulltext=None):
+    tmp_path = f"{db_path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path, isolation_level=None)
+    try:
+        # No need for a journal or syncing during the build, as we start from scratch each time:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("BEGIN")
+        columns = get_columns()
+        create_schema(conn, columns)
+        count = load_publications(conn, pubs, [name for name, _ in columns], batch_size, authors)
+        logger.info(f"Loaded {count} publications.")
+        build_fts(conn)
+        if fulltext:
+            logger.info(f"Loaded the full text of {build_fulltext(conn, fulltext)} documents.")
+        build_indexes(conn)
+        build_summary_tables(conn)
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+    except BaseException:
+        conn.close()
+        os.remove(tmp_path)
+        raise
+    conn.close()
+    os.replace(tmp_path, db_path)
+    return count
+
+
+# Main for CLI
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # Set up a simpler argument parser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output_db')
+    parser.add_argument('input_jsonl', nargs='?', help="The merged JSONL file to load.")
+    parser.add_argument('--from-raw', dest='raw_dir', help="Load straight from the merger, reading the raw source files in this folder, instead of from a merged JSONL file.")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of merger worker processes to use with --from-raw.")
+    parser.add_argument('--cache-dir', help="Merger shard cache folder to use with --from-raw.")
+    parser.add_argument('--dedup', action='store_true', help="With --from-raw, merge the duplicate records, as the merger does with --dedup (and the Makefile build does with MERGE_DEDUP=--dedup). Without it, every record is loaded.")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--authors', help="Author index JSON file (as written by the merger), used to group creator name variants under their canonical names.")
+    parser.add_argument('--fulltext', help="Full-text store folder (as written by dppi.fulltext), to load the extracted text of the documents into a separate full-text index.")
+
+    args = parser.parse_args()
+
+    authors = AuthorIndex.load(args.authors) if args.authors else None
+
+    if args.raw_dir:
+        from .merger import generate_publications
+        from .models import PubPathIndex
+        from .dedup import Deduplicator
+        pubs = generate_publications(args.raw_dir, jobs=args.jobs, cache_dir=args.cache_dir, path_index=PubPathIndex(), deduplicator=Deduplicator() if args.dedup else None, authors=authors)
+    elif args.input_jsonl:
+        pubs = read_publications_jsonl(args.input_jsonl)
+    else:
+        parser.error("Either an input JSONL file or --from-raw must be specified.")
+
+    fulltext = FulltextStore(args.fulltext) if args.fulltext else None
+
+    build_database(args.output_db, pubs, batch_size=args.batch_size, authors=authors, fulltext=fulltext)
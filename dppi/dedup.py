@@ -0,0 +1,178 @@
+import re
+import logging
+import unicodedata
+from difflib import SequenceMatcher
+from .models import Publication
+
+logger = logging.getLogger(__name__)
+
+# Link fields that get merged into the retained record when duplicates are found:
+LINK_FIELDS = ['landing_page_url', 'document_url', 'slides_url', 'notes_url', 'stream_url', 'submission_url']
+# Words that are too common to be useful for blocking:
+STOP_WORDS = set("a an and are as at by digital for from in into is of on or preservation the to towards with".split())
+# Each record is blocked under its rarest title tokens:
+BLOCK_KEYS_PER_RECORD = 3
+# Tokens shared by more records than this are not used for blocking, which keeps the comparisons near-linear:
+MAX_BLOCK_SIZE = 50
+# Thresholds for counting a pair as a duplicate:
+MIN_TITLE_SIMILARITY = 0.85
+MIN_SCORE = 0.8
+TITLE_WEIGHT = 0.7
+
+NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+# Titles of whole-proceedings volumes (as canonicalised), for the sources that don't give these their own type:
+PROCEEDINGS_TITLE_RE = re.compile(r"\bproceedings of (the )?\w+ international conference\b|\bconference proceedings$")
+
+def strip_accents(text):
+    return "".join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+# Lower case, no accents or punctuation, single spaces:
+def canon_title(title):
+    return NON_WORD_RE.sub(" ", strip_accents(title).lower()).strip()
+
+def title_tokens(canon):
+    return set(token for token in canon.split(" ") if len(token) > 2 and token not in STOP_WORDS)
+
+def creator_surnames(pub: Publication):
+    return set(canon_title(creator).split(" ")[-1] for creator in (pub.creators or []) if canon_title(creator))
+
+# Scores a candidate pair, returning the title similarity and the combined score:
+def score_pair(a, b):
+    title_similarity = SequenceMatcher(None, a['canon'], b['canon']).ratio()
+    if a['surnames'] and b['surnames']:
+        creator_overlap = len(a['surnames'] & b['surnames']) / len(a['surnames'] | b['surnames'])
+    else:
+        # Can't tell either way, so rely on the title:
+        creator_overlap = title_similarity
+    return title_similarity, TITLE_WEIGHT * title_similarity + (1 - TITLE_WEIGHT) * creator_overlap
+
+# Finds clusters of duplicates among a set of records (e.g. from one year), using blocking on rare title tokens so
+# only records that share at least one of these get compared:
+def find_clusters(pubs):
+    entries = []
+    token_counts = {}
+    for pub in pubs:
+        canon = canon_title(pub.title)
+        tokens = title_tokens(canon)
+        entries.append({ 'canon': canon, 'tokens': tokens, 'surnames': creator_surnames(pub) })
+        for token in tokens:
+            token_counts[token] = token_counts.get(token, 0) + 1
+
+    # Block each record under its rarest tokens:
+    blocks = {}
+    for i, entry in enumerate(entries):
+        usable = [token for token in entry['tokens'] if token_counts[token] <= MAX_BLOCK_SIZE]
+        for token in sorted(usable, key=lambda t: (token_counts[t], t))[:BLOCK_KEYS_PER_RECORD]:
+            blocks.setdefault(token, []).append(i)
+
+    # Score the candidate pairs, and union the duplicates:
+    parent = list(range(len(entries)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    scores = {}
+    links = {}
+    for members in blocks.values():
+        for x in range(len(members)):
+            for y in range(x + 1, len(members)):
+                i, j = members[x], members[y]
+                if (i, j) in scores:
+                    continue
+                title_similarity, score = score_pair(entries[i], entries[j])
+                scores[(i, j)] = score
+                if title_similarity >= MIN_TITLE_SIMILARITY and score >= MIN_SCORE:
+                    links[(i, j)] = score
+                    root_i, root_j = find(i), find(j)
+                    if root_i != root_j:
+                        parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    clusters = {}
+    for i in range(len(entries)):
+        clusters.setdefault(find(i), []).append(i)
+    return [members for members in clusters.values() if len(members) > 1], links
+
+# A whole-proceedings volume contains the year's papers, rather than duplicating any one of them, so these are listed separately:
+def is_proceedings(pub: Publication):
+    return pub.type == 'proceedings' or PROCEEDINGS_TITLE_RE.search(canon_title(pub.title)) is not None
+
+# Only records of the same type, and without different documents, are taken to be copies of each other (e.g. a poster and
+# the paper on the same work, or the text and image of a poster, are clustered, but are kept as separate records):
+def can_merge(a: Publication, b: Publication):
+    return a.type == b.type and (not a.document_url or not b.document_url or a.document_url == b.document_url)
+
+# Split a cluster into the groups of records that can be merged, each group led by its first record:
+def merge_groups(pubs):
+    groups = []
+    for pub in pubs:
+        for group in groups:
+            if all(can_merge(member, pub) for member in group):
+                group.append(pub)
+                break
+        else:
+            groups.append([pub])
+    return groups
+
+# Merge a group of copies into its first record, filling in any missing link fields from the others:
+def merge_cluster(pubs):
+    primary = pubs[0]
+    for other in pubs[1:]:
+        for field in LINK_FIELDS:
+            if not getattr(primary, field) and getattr(other, field):
+                setattr(primary, field, getattr(other, field))
+    return primary
+
+def describe(pub: Publication):
+    return { 'source_name': pub.source_name, 'title': pub.title, 'type': pub.type, 'landing_page_url': pub.landing_page_url, 'document_url': pub.document_url }
+
+# Dedup stage for the merger. Records are processed a year at a time (the merger outputs them in year order), and the
+# clusters of duplicates found are kept for reporting, along with any whole-proceedings volumes. Within each cluster,
+# the records that are copies of each other (see can_merge) are merged into the first of them, and the rest dropped.
+# With merge=False, the clusters are only reported, and all the records are passed through unchanged:
+class Deduplicator:
+    def __init__(self, merge=True):
+        self.merge = merge
+        self.clusters = []
+        self.proceedings = []
+
+    def _process_year(self, pubs):
+        volumes = [pub for pub in pubs if is_proceedings(pub)]
+        for pub in volumes:
+            self.proceedings.append({ 'year': pub.year, **describe(pub), 'year_records': len(pubs) - len(volumes) })
+        candidates = [pub for pub in pubs if not is_proceedings(pub)]
+        clusters, links = find_clusters(candidates)
+        drop = set()
+        for members in clusters:
+            cluster_pubs = [candidates[i] for i in members]
+            dropped = set()
+            if self.merge:
+                for group in merge_groups(cluster_pubs):
+                    merge_cluster(group)
+                    dropped.update(id(pub) for pub in group[1:])
+            self.clusters.append({
+                'year': cluster_pubs[0].year,
+                'records': [{ **describe(pub), 'kept': id(pub) not in dropped } for pub in cluster_pubs],
+                # The weakest of the links that put the records in this cluster:
+                'min_score': min(links[(i, j)] for i in members for j in members if (i, j) in links),
+            })
+            drop.update(dropped)
+        for pub in pubs:
+            if id(pub) not in drop:
+                yield pub
+
+    # The clusters and proceedings volumes found, for writing out as JSON:
+    def report(self):
+        return { 'clusters': self.clusters, 'proceedings': self.proceedings }
+
+    def process(self, pubs):
+        year_pubs = []
+        for pub in pubs:
+            if year_pubs and pub.year != year_pubs[0].year:
+                yield from self._process_year(year_pubs)
+                year_pubs = []
+            year_pubs.append(pub)
+        if year_pubs:
+            yield from self._process_year(year_pubs)
+        dropped = sum(not record['kept'] for cluster in self.clusters for record in cluster['records'])
+        logger.info(f"Found {len(self.clusters)} clusters of duplicates, merging {dropped} records, and {len(self.proceedings)} proceedings volumes.")
@@ -1,14 +1,18 @@
 import sys
 import json
 from sickle import Sickle
-import requests
-import lxml.html
 import logging
 import argparse
+from . import instrument
+from .instrument import get_report
+from .snapshots import write_source
+from .utils import resolve_pdf_url, ordered_pool_map, DEFAULT_RESOLVER_WORKERS
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# The handle landing pages rarely change, so can be cached for a while:
+HANDLE_TTL = 30*24*60*60
+
 sickle = Sickle('https://www.ideals.illinois.edu/oai-pmh')
 
 # This function was used to work out what the right metadata set ID was:
@@ -18,30 +22,33 @@ def list_all_sets(sickle):
         print(s)
 
 
-# This gets the records for a set and outputs them
-def write_set_to_file(oai_set, output_file):
+# Works out the handle URL for a record and de-references it to find the citation_pdf_url:
+def resolve_record(r):
+    doc = r.get_metadata()
+    doc['oai_identifier'] = r.header.identifier
+    # Have to know to reconstruct this (e.g. oai:www.ideals.illinois.edu:2142/121087) into a handle:
+    handle_id = doc['oai_identifier'].split(":")[2]
+    source_url = f"https://hdl.handle.net/{handle_id}"
+    # De-reference and parse for citation_pdf_url:
+    logger.info(f"Getting {source_url}...")
+    pdf_url = resolve_pdf_url(source_url, ttl=HANDLE_TTL)
+    # Store additional data:
+    doc['source_url'] = source_url
+    doc['pdf_url'] = pdf_url
+    return doc
+
+# This gets the records for a set and outputs them (as a new snapshot, if the output folder is a snapshot store).
+# The handles are resolved by a pool of workers as the records are harvested, but are written out in the OAI order:
+def write_set_to_file(oai_set, output_file, workers=DEFAULT_RESOLVER_WORKERS):
     logger.info(f"Listing the records for collection {oai_set}...")
     recs = sickle.ListRecords(metadataPrefix="oai_dc", set=oai_set)
     logger.info(f"Writing records to {output_file}...")
-    with open(output_file, 'w') as f:
-        for r in recs:
-            doc = r.get_metadata()
-            doc['oai_identifier'] = r.header.identifier
-            # Have to know to reconstruct this (e.g. oai:www.ideals.illinois.edu:2142/121087) into a handle:
-            handle_id = doc['oai_identifier'].split(":")[2]
-            source_url = f"https://hdl.handle.net/{handle_id}"
-            # De-reference and parse for citation_pdf_url:
-            logger.info(f"Getting {source_url}...")
-            response = requests.get(source_url, allow_redirects=True)
-            response.raise_for_status()  # Raise an exception for bad responses
-            tree = lxml.html.fromstring(response.text)
-            pdf_url = tree.xpath('/html/head/meta[@name="citation_pdf_url"]')[0].attrib['content']
-            # Store additional data:
-            doc['source_url'] = source_url
-            doc['pdf_url'] = pdf_url
+    with write_source(output_file) as f:
+        for r, doc in get_report().track('harvest', ordered_pool_map(resolve_record, recs, workers=workers)):
             # Send to file:
-            f.write(json.dumps(doc))
-            f.write('\n')
+            with get_report().timer('write'):
+                f.write(json.dumps(doc))
+                f.write('\n')
 
 
 
@@ -49,8 +56,12 @@ if __name__ == "__main__":
     # Set up a simpler argument parser:
     parser = argparse.ArgumentParser()
     parser.add_argument('output_jsonl')
+    parser.add_argument('--workers', type=int, default=DEFAULT_RESOLVER_WORKERS, help="Number of handles to resolve at the same time.")
+
+    instrument.add_arguments(parser)
 
     args = parser.parse_args()
+    instrument.start(args, 'fetcher-ideals')
 
     # This gets the records for the iPRES 2023 metadata set:
-    write_set_to_file("com_2142_120947", args.output_jsonl)
\ No newline at end of file
+    write_set_to_file("com_2142_120947", args.output_jsonl, workers=args.workers)
\ No newline at end of file
@@ -1,23 +1,21 @@
+import os
+import sys
 import json
 import logging
-import requests
-from requests.adapters import HTTPAdapter, Retry
-from .models import Publication
+import argparse
+from . import instrument
+from .httpcache import get_http_cache
+from .instrument import get_report
+from .snapshots import write_source
+from .utils import ordered_pool_map
 from pyzotero import zotero
 
-# Set up a polite retry session:
-s = requests.Session()
-retries = Retry(total=5, backoff_factor=1)
-s.mount('http://', HTTPAdapter(max_retries=retries))
-
-# So we can see what's happening:
-logging.basicConfig(level=logging.DEBUG)
+logger = logging.getLogger(__name__)
 
 # Connect to the iPRES group library:
-library_id = '5564150' 
+library_id = '5564150'
 library_type = 'group'
 api_key = None # No key needed to read...
-zot = zotero.Zotero(library_id, library_type, api_key)
 
 # Each kind of publication is in a separate Zotero collection:
 kinds = {
@@ -29,34 +27,158 @@ kinds = {
     "Poster": "4M6S4PBV",
     "Short Paper": "TZKTD9WG",
     "Tutorial": "9FTP48DL",
-    "Workshop": "PIDIXJUZ", 
+    "Workshop": "PIDIXJUZ",
 }
+# If an item has been filed under more than one kind, the first of these is used (so e.g. a paper that's also in the
+# Poster collection is still a paper):
+kind_precedence = ["Long Paper", "Short Paper", "Panel", "Workshop", "Tutorial", "Keynote", "Poster", "Lightning Talk", "Game"]
+
+OSF_API_URL = "https://api.osf.io/v2"
+# OSF file listings only change if the files are updated:
+OSF_TTL = 7*24*60*60
+# Number of OSF file listings to fetch at the same time:
+DEFAULT_OSF_WORKERS = 8
+
+# The local item store, which remembers the library version it was last synced to:
+def empty_store():
+    return { 'library_version': 0, 'collections': { kind: [] for kind in kinds }, 'items': {} }
+
+def load_store(store_path):
+    if store_path and os.path.exists(store_path):
+        with open(store_path) as f:
+            return json.load(f)
+    return empty_store()
+
+def save_store(store_path, store):
+    with open(f"{store_path}.tmp", 'w') as f:
+        json.dump(store, f)
+    os.replace(f"{store_path}.tmp", store_path)
+
+# For attachments, check for an OSF link:
+def get_osf_id(item):
+    att = item['data']
+    if att['itemType'] == 'attachment' and att['linkMode'] == 'imported_url' and att['url'].startswith("https://osf.io/"):
+        osf_id = att['url'].replace('https://osf.io/', '')
+        return osf_id.replace('/','')
+    return None
+
+# Get the listing of the files held in OSF for an attachment, and record the details:
+def add_osf_files(item):
+    att = item['data']
+    osf_id = get_osf_id(item)
+    att['osf_id'] = osf_id
+    att['landing_page'] = att['url']
+    osf_files_url = f"{OSF_API_URL}/nodes/{osf_id}/files/osfstorage/?filter%5Bname%5D=&format=json&page=1&sort=name"
+    r = get_http_cache().get(osf_files_url, ttl=OSF_TTL)
+    if r.status_code != 200:
+        raise Exception("FAILED!")
+    att['osf_files'] = r.json()
+    return item
+
+# Bring the local item store up to date, only asking Zotero for items modified since the last sync:
+def sync_store(zot, store, osf_workers=DEFAULT_OSF_WORKERS):
+    since = store['library_version']
+    library_version = zot.last_modified_version()
+    if since == library_version:
+        logger.info(f"Item store is already up to date with library version {library_version}.")
+        return store
+    logger.info(f"Syncing item store from library version {since} to {library_version}...")
+
+    # Drop anything that's been deleted:
+    if since > 0:
+        deleted = set(zot.deleted(since=since).get('items', []))
+        for key in deleted:
+            store['items'].pop(key, None)
+
+    # Get the new and modified items for each kind:
+    to_fetch = []
+    for pub_type, collection_key in kinds.items():
+        with get_report().timer(f"zotero:{pub_type}", 0):
+            if since > 0:
+                items = zot.everything(zot.collection_items(collection_key, since=since))
+            else:
+                items = zot.everything(zot.collection_items(collection_key))
+        get_report().add(f"zotero:{pub_type}", count=len(items))
+        for item in items:
+            key = item['key']
+            old_item = store['items'].get(key)
+            if get_osf_id(item):
+                # Only get the OSF file listings for new or changed attachments:
+                if old_item and old_item['version'] == item['version'] and 'osf_files' in old_item['data']:
+                    for field in ['osf_id', 'landing_page', 'osf_files']:
+                        item['data'][field] = old_item['data'][field]
+                else:
+                    to_fetch.append(item)
+            store['items'][key] = item
+    rebuild_collections(store)
 
-# Loop through the kinds:
-for pub_type, collection_key in kinds.items():
+    # Get the OSF file listings concurrently:
+    logger.info(f"Getting OSF file listings for {len(to_fetch)} attachments...")
+    for item, _ in get_report().track('osf', ordered_pool_map(add_osf_files, to_fetch, workers=osf_workers)):
+        logger.debug(f"Got OSF file listing for {item['key']}.")
 
-    # Get the whole set of items for this kind:
-    items = zot.everything(zot.collection_items(collection_key))
+    store['library_version'] = library_version
+    return store
 
-    # Convert to JSON:
-    for item in items:
-        # Note item type based on collection (on normal items, not on attachments):
+# The kind of an item, from the collections it's in (or for an attachment, the ones its parent item is in):
+def get_kind(store, item):
+    data = item['data']
+    if 'parentItem' in data:
+        parent = store['items'].get(data['parentItem'])
+        data = parent['data'] if parent else {}
+    item_kinds = [kind for kind in kind_precedence if kinds[kind] in data.get('collections', [])]
+    return item_kinds[0] if item_kinds else None
+
+# Work out which items are in each kind's collection from the items themselves, so items that have been moved between
+# collections (or removed from one) are only listed where they are now, and note the type of each (normal) item:
+def rebuild_collections(store):
+    collections = { kind: [] for kind in kinds }
+    for key, item in store['items'].items():
+        kind = get_kind(store, item)
         if item['data']['itemType'] != "attachment":
-            item['publication_type'] = pub_type
-        else:
-            # For attachments, check for an OSF link and grab it:
-            att = item['data']
-            if att['linkMode'] == 'imported_url' and att['url'].startswith("https://osf.io/"):
-                landing_page = att['url']
-                osf_id = landing_page.replace('https://osf.io/', '')
-                osf_id = osf_id.replace('/','')
-                # And record the details:
-                att['osf_id'] = osf_id
-                att['landing_page'] = landing_page
-                osf_files_url = f"https://api.osf.io/v2/nodes/{osf_id}/files/osfstorage/?filter%5Bname%5D=&format=json&page=1&sort=name"
-                r = s.get(osf_files_url)
-                if r.status_code != 200:
-                    raise Exception("FAILED!")
-                att['osf_files'] = r.json()
-
-        print(json.dumps(item))
+            item['publication_type'] = kind
+        if kind:
+            collections[kind].append(key)
+    store['collections'] = collections
+
+# Regenerate the dump of all the items from the store, in key order, so it doesn't depend on the order they were synced in:
+def write_items(store, outfile):
+    keys = sorted(key for kind in kinds for key in store['collections'].get(kind, []))
+    for key in keys:
+        outfile.write(json.dumps(store['items'][key]))
+        outfile.write('\n')
+
+
+# Main for CLI
+if __name__ == "__main__":
+    # Set up a simpler argument parser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', help="Local item store, used to only fetch items that have changed since the last run. If not set, everything is fetched.")
+    parser.add_argument('--full', action='store_true', help="Ignore the contents of the store and fetch everything again.")
+    parser.add_argument('--osf-workers', type=int, default=DEFAULT_OSF_WORKERS, help="Number of OSF file listings to fetch at the same time.")
+    parser.add_argument('--zotero-endpoint', help="Override the Zotero API endpoint (e.g. to use a local mock).")
+    parser.add_argument('--osf-api', default=OSF_API_URL, help="Override the OSF API endpoint (e.g. to use a local mock).")
+    parser.add_argument('--output', help="Write the items to this file (stored as a new snapshot if the folder is a snapshot store), rather than to standard output.")
+
+    # Defaults to DEBUG so we can see what's happening:
+    instrument.add_arguments(parser)
+    parser.set_defaults(log_level='DEBUG')
+
+    args = parser.parse_args()
+    instrument.start(args, 'fetcher-zotero')
+    OSF_API_URL = args.osf_api
+
+    zot = zotero.Zotero(library_id, library_type, api_key)
+    if args.zotero_endpoint:
+        zot.endpoint = args.zotero_endpoint
+
+    store = empty_store() if args.full else load_store(args.store)
+    store = sync_store(zot, store, osf_workers=args.osf_workers)
+    if args.store:
+        save_store(args.store, store)
+
+    if args.output:
+        with write_source(args.output) as f:
+            write_items(store, f)
+    else:
+        write_items(store, sys.stdout)
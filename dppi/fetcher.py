@@ -1,35 +1,86 @@
-import urllib.request
 import argparse
+import logging
 import json
 import csv
 import os.path
+import time
+from . import instrument
+from .httpcache import get_http_cache
+from .instrument import get_report
+from .snapshots import write_source
+from .utils import ordered_pool_map
+
+logger = logging.getLogger(__name__)
 
 PHAIDRA_API_URL = "https://services.phaidra.univie.ac.at/api"
+# Number of Solr results to request per page:
+DEFAULT_PAGE_SIZE = 500
+# Number of collections to fetch at the same time:
+DEFAULT_CONCURRENCY = 4
+# How long to use cached Phaidra responses before revalidating them:
+PHAIDRA_TTL = 24*60*60
 
-def get_phaidra_metadata(col_id, source_name, year, output_path):
+# Get one page of results for a collection, returning the (possibly cached) response:
+def get_phaidra_page(col_id, start, rows, ttl=PHAIDRA_TTL):
     params = {
         "q" : "*:*",
         "wt" : "json",
-        "rows" : 1000,
+        "start" : start,
+        "rows" : rows,
         "fq" : f'ispartof:"{col_id}"',
         "indent" : "true",
     }
-    data = urllib.parse.urlencode(params).encode(encoding='utf-8',errors='ignore')
-    req = urllib.request.Request(url=f"{PHAIDRA_API_URL}/search/select", data=data)
-    res = urllib.request.urlopen(req, timeout=15)
+    res = get_http_cache().post(f"{PHAIDRA_API_URL}/search/select", data=params, ttl=ttl, timeout=15)
+
+    if res.status_code != 200:
+        raise Exception(f"API call failed! -- {res.status_code}")
 
-    if res.status != 200:
-        raise Exception(f"API call failed! -- {res.reason}")
+    return res
 
-    j = json.loads(res.read().decode("utf-8"))
+# Page through all the results for a collection, streaming the docs to the output file as they arrive.
+# The output is written to a temporary file first, so a failed fetch doesn't clobber the previous version,
+# and if the output folder is a snapshot store, it's stored as a new snapshot.
+# A collection that fits in one page can come from the cache, but the pages of a bigger one are all fetched afresh,
+# so they're all from the same state of the index, rather than a mix of cached and fresh pages. Records are left in
+# Solr's own order (as in the existing snapshots), and any that shift between pages are caught:
+def get_phaidra_metadata(col_id, source_name, year, output_path, page_size=DEFAULT_PAGE_SIZE):
+    logger.info(f"Fetching collection {col_id} for {source_name} {year}...")
+    # Collections are fetched concurrently, so each one is timed separately rather than with a report timer:
+    started = time.perf_counter()
+    res = get_phaidra_page(col_id, 0, page_size)
+    j = res.json()
+    if res.from_cache and len(j['response']['docs']) < j['response']['numFound']:
+        j = get_phaidra_page(col_id, 0, page_size, ttl=0).json()
+    start = 0
+    seen = set()
+    with write_source(output_path) as outfile:
+        while True:
+            docs = j['response']['docs']
+            for doc in docs:
+                # If the collection changes while it's being paged through, records can shift between pages:
+                if doc['pid'] in seen:
+                    raise Exception(f"Got record {doc['pid']} twice for collection {col_id}, so the collection changed during the fetch!")
+                seen.add(doc['pid'])
+                doc['__source_col_id'] = col_id
+                doc['__source_name'] = source_name
+                doc['__year'] = year
+                json.dump(doc, outfile)
+                outfile.write('\n')
+            start += len(docs)
+            if len(docs) == 0 or start >= j['response']['numFound']:
+                break
+            j = get_phaidra_page(col_id, start, page_size, ttl=0).json()
+        if start < j['response']['numFound']:
+            raise Exception(f"Only got {start} of {j['response']['numFound']} records for collection {col_id}!")
+    get_report().add(f"collection:{col_id}", time.perf_counter() - started, start)
+    logger.info(f"Wrote {start} records for collection {col_id} to {output_path}.")
+    return start
 
-    with open(output_path, 'w') as outfile:
-        for doc in j['response']['docs']:
-            doc['__source_col_id'] = col_id
-            doc['__source_name'] = source_name
-            doc['__year'] = year
-            json.dump(doc, outfile)
-            outfile.write('\n')
+# Fetch a set of collections concurrently, at most `concurrency` at a time:
+def get_all_phaidra_metadata(collections, page_size=DEFAULT_PAGE_SIZE, concurrency=DEFAULT_CONCURRENCY):
+    fetch = lambda collection: get_phaidra_metadata(*collection, page_size=page_size)
+    for collection, count in ordered_pool_map(fetch, collections, workers=concurrency):
+        logger.debug(f"Fetched {count} records for collection {collection[0]}.")
 
 
 # Main for CLI
@@ -39,11 +90,17 @@ if __name__ == "__main__":
     parser.add_argument('action', choices=['fetch-metadata'])
     parser.add_argument('input_csv')
     parser.add_argument('output_dir')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE, help="Number of records to request per page.")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="Maximum number of collections to fetch at the same time.")
+
+    instrument.add_arguments(parser)
 
     args = parser.parse_args()
+    instrument.start(args, 'fetcher')
 
     if args.action == "fetch-metadata":
         # Open the source CSV, read the starting point for each iPres conference site, and parse.
+        collections = []
         with open(args.input_csv) as csv_file:
             reader = csv.DictReader(csv_file)
             for row in reader:
@@ -52,8 +109,10 @@ if __name__ == "__main__":
                     if not os.path.exists(args.output_dir):
                         os.makedirs(args.output_dir)
                     output_path = os.path.join(args.output_dir, f"{row['source_name'].lower()}{row['year']}.phaidra.jsonl")
-                    get_phaidra_metadata(row['repo_collection_id'], row['source_name'], int(row['year']), output_path)
+                    collections.append((row['repo_collection_id'], row['source_name'], int(row['year']), output_path))
                 else:
                     raise Exception(f"Unsupported repository system '{row['repo_system']}'!")
+        # Fetch them all:
+        get_all_phaidra_metadata(collections, args.page_size, args.concurrency)
     else:
-        raise Exception(f"Unimplemented action '{args.action}'!")
\ No newline at end of file
+        raise Exception(f"Unimplemented action '{args.action}'!")
@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+import itertools
+import threading
+import urllib.parse
+import requests
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from . import instrument
+from .httpcache import make_session
+from .instrument import get_report
+from .models import read_publications_jsonl
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE_DIR = '.fulltext'
+# Number of documents to download at the same time, overall and from any one host:
+DEFAULT_WORKERS = 8
+DEFAULT_PER_HOST = 2
+DOWNLOAD_TIMEOUT = 60
+CHUNK_SIZE = 1024*1024
+# How often to save the manifest while harvesting or extracting, so an interrupted run doesn't lose much:
+SAVE_EVERY = 25
+MANIFEST = 'manifest.json'
+
+# Content-addressed store for the harvested documents and the text extracted from them.
+# The documents are stored under their SHA-256 hash, with the manifest mapping each document URL to its hash, and recording
+# the text extraction results for each hash, so identical documents are only stored and extracted once.
+class FulltextStore:
+    def __init__(self, store_dir=DEFAULT_STORE_DIR):
+        self.store_dir = store_dir
+        self.lock = threading.Lock()
+        self.documents = {}
+        self.texts = {}
+        manifest_path = os.path.join(store_dir, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            self.documents = manifest['documents']
+            self.texts = manifest['texts']
+
+    def save(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        manifest_path = os.path.join(self.store_dir, MANIFEST)
+        with self.lock:
+            with open(f"{manifest_path}.tmp", 'w') as f:
+                json.dump({ 'documents': self.documents, 'texts': self.texts }, f, indent=1, sort_keys=True)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    def object_path(self, sha256):
+        return os.path.join(self.store_dir, 'objects', sha256[:2], sha256)
+
+    def text_path(self, sha256):
+        return os.path.join(self.store_dir, 'text', sha256[:2], f"{sha256}.txt")
+
+    # Do we already have the document at this URL? If the source gives a size (as Phaidra does), a change in size means it gets fetched again:
+    def has_document(self, url, source_size=None):
+        entry = self.documents.get(url)
+        if not entry or 'sha256' not in entry:
+            return False
+        if source_size is not None and entry.get('source_size') != source_size:
+            return False
+        return os.path.exists(self.object_path(entry['sha256']))
+
+    def add_document(self, url, entry):
+        with self.lock:
+            self.documents[url] = entry
+
+    # The extracted text for the document at a URL, as (sha256, pages, text), or None if there isn't any:
+    def get_text(self, url):
+        entry = self.documents.get(url)
+        if not entry or 'sha256' not in entry:
+            return None
+        result = self.texts.get(entry['sha256'])
+        if not result or 'error' in result:
+            return None
+        with open(self.text_path(entry['sha256']), encoding='utf-8') as f:
+            return entry['sha256'], result['pages'], f.read()
+
+# Apply any FROM=TO URL prefix mappings (e.g. to fetch from a local stand-in server):
+def map_url(url, url_map=None):
+    for prefix, replacement in (url_map or {}).items():
+        if url.startswith(prefix):
+            return replacement + url[len(prefix):]
+    return url
+
+def get_host(url):
+    return urllib.parse.urlparse(url).netloc
+
+# Stream a document into the store, hashing it as it goes. It's written to a temporary file and then moved into place,
+# so an interrupted download never leaves a partial object behind:
+def download_document(session, store, url, fetch_url, limiter):
+    tmp_dir = os.path.join(store.store_dir, 'tmp')
+    os.makedirs(tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(tmp_dir, f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.part")
+    h = hashlib.sha256()
+    size = 0
+    with limiter:
+        start = time.perf_counter()
+        try:
+            with session.get(fetch_url, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+                if r.status_code == 200:
+                    with open(tmp_path, 'wb') as f:
+                        for chunk in r.iter_content(CHUNK_SIZE):
+                            h.update(chunk)
+                            f.write(chunk)
+                            size += len(chunk)
+        except requests.RequestException as e:
+            return { 'error': str(e), 'fetched_at': time.time() }
+        get_report().record_http('GET', fetch_url, time.perf_counter() - start, r.status_code)
+    if r.status_code != 200:
+        return { 'error': f"HTTP {r.status_code}", 'fetched_at': time.time() }
+    sha256 = h.hexdigest()
+    object_path = store.object_path(sha256)
+    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+    os.replace(tmp_path, object_path)
+    return { 'sha256': sha256, 'size': size, 'content_type': r.headers.get('Content-Type'), 'fetched_at': time.time() }
+
+# Download the documents for a set of publications that aren't already in the store.
+# The downloads are spread over a pool of threads, with at most `per_host` going to any one host at a time,
+# and the hosts interleaved so the workers aren't all queued up on the same one:
+def harvest(pubs, store, workers=DEFAULT_WORKERS, per_host=DEFAULT_PER_HOST, url_map=None):
+    to_fetch = {}
+    for pub in pubs:
+        url = pub.document_url
+        if not url or url in to_fetch:
+            continue
+        if store.has_document(url, pub.size):
+            get_report().record_cache('fulltext', 'hits')
+        else:
+            get_report().record_cache('fulltext', 'misses')
+            to_fetch[url] = pub.size
+    by_host = {}
+    for url in to_fetch:
+        by_host.setdefault(get_host(url), []).append(url)
+    urls = [url for urls in itertools.zip_longest(*by_host.values()) for url in urls if url]
+    logger.info(f"Downloading {len(urls)} documents from {len(by_host)} hosts...")
+
+    limiters = { host: threading.Semaphore(per_host) for host in by_host }
+    session = make_session(pool_size=workers)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    done = failed = 0
+    try:
+        futures = {
+            executor.submit(download_document, session, store, url, map_url(url, url_map), limiters[get_host(url)]): url
+            for url in urls
+        }
+        for future in get_report().track('download', as_completed(futures)):
+            url = futures[future]
+            entry = future.result()
+            entry['source_size'] = to_fetch[url]
+            store.add_document(url, entry)
+            if 'error' in entry:
+                logger.warning(f"Could not download {url}: {entry['error']}")
+                failed += 1
+            elif entry['source_size'] is not None and entry['size'] != entry['source_size']:
+                logger.warning(f"Got {entry['size']} bytes for {url}, but the source says {entry['source_size']}.")
+            done += 1
+            if done % SAVE_EVERY == 0:
+                store.save()
+                logger.info(f"Downloaded {done} of {len(urls)} documents...")
+    finally:
+        executor.shutdown(cancel_futures=True)
+        store.save()
+    logger.info(f"Downloaded {done - failed} documents, and {failed} failed.")
+
+# Worker: extract the text from a stored PDF, writing it to the text store:
+def extract_text(object_path, text_path):
+    from pypdf import PdfReader
+    with open(object_path, 'rb') as f:
+        if f.read(5) != b'%PDF-':
+            return { 'error': "Not a PDF" }
+    try:
+        reader = PdfReader(object_path)
+        pages = [page.extract_text() or "" for page in reader.pages]
+    except Exception as e:
+        return { 'error': f"{type(e).__name__}: {e}" }
+    text = "\n\n".join(pages)
+    os.makedirs(os.path.dirname(text_path), exist_ok=True)
+    with open(f"{text_path}.tmp", 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(f"{text_path}.tmp", text_path)
+    return { 'pages': len(pages), 'chars': len(text) }
+
+# Extract the text from any stored documents that haven't been done yet, in a pool of worker processes:
+def extract_all(store, jobs=1):
+    try:
+        import pypdf
+    except ImportError:
+        raise Exception("Text extraction needs pypdf, e.g. via: pip install 'digipres-practice-index[fulltext]'")
+    hashes = sorted(set(
+        entry['sha256'] for entry in store.documents.values()
+        if 'sha256' in entry and entry['sha256'] not in store.texts
+    ))
+    logger.info(f"Extracting text from {len(hashes)} documents...")
+    object_paths = [store.object_path(sha256) for sha256 in hashes]
+    text_paths = [store.text_path(sha256) for sha256 in hashes]
+    executor = ProcessPoolExecutor(max_workers=jobs)
+    done = 0
+    try:
+        results = get_report().track('extract', executor.map(extract_text, object_paths, text_paths))
+        for sha256, result in zip(hashes, results):
+            with store.lock:
+                store.texts[sha256] = result
+            if 'error' in result:
+                logger.warning(f"Could not extract text from {store.object_path(sha256)}: {result['error']}")
+            done += 1
+            if done % SAVE_EVERY == 0:
+                store.save()
+                logger.info(f"Extracted {done} of {len(hashes)} documents...")
+    finally:
+        executor.shutdown(cancel_futures=True)
+        store.save()
+    logger.info(f"Extracted text from {sum(1 for sha256 in hashes if 'error' not in store.texts[sha256])} of {len(hashes)} documents.")
+
+
+# Main for CLI
+if __name__ == "__main__":
+    # Set up a simpler argument parser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('action', choices=['harvest', 'extract'])
+    parser.add_argument('input_jsonl', nargs='?', help="The merged JSONL file, listing the publications and their document URLs (needed to harvest).")
+    parser.add_argument('--store', default=DEFAULT_STORE_DIR, help=f"Folder to keep the documents and extracted text in (default: {DEFAULT_STORE_DIR}).")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Number of documents to download at the same time.")
+    parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST, help="Number of documents to download at the same time from any one host.")
+    parser.add_argument('--jobs', type=int, default=1, help="Number of worker processes to extract the text with.")
+    parser.add_argument('--url-map', action='append', default=[], metavar='FROM=TO', help="Fetch URLs starting with FROM from TO instead (e.g. to use a local stand-in server). Can be repeated.")
+    instrument.add_arguments(parser)
+
+    args = parser.parse_args()
+    instrument.start(args, 'fulltext')
+
+    store = FulltextStore(args.store)
+    if args.action == 'harvest':
+        if not args.input_jsonl:
+            parser.error("The publications JSONL file is needed to harvest the documents.")
+        url_map = dict(mapping.split('=', 1) for mapping in args.url_map)
+        harvest(read_publications_jsonl(args.input_jsonl), store, args.workers, args.per_host, url_map)
+    elif args.action == 'extract':
+        extract_all(store, args.jobs)
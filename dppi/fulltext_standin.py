@@ -0,0 +1,120 @@
+import os
+import sys
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from .models import read_publications_jsonl
+from .fulltext import FulltextStore, harvest, extract_all
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8000
+
+# A minimal one-page PDF with some lines of (ASCII) text, which pypdf can extract again:
+def make_pdf(lines):
+    escape = lambda line: line.encode('ascii', 'replace').replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+    stream = b"BT /F1 12 Tf 72 720 Td 14 TL " + b" ".join(b"(" + escape(line) + b") '" for line in lines) + b" ET"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        pdf += b"%010d 00000 n \n" % offset
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+# Serves a sample PDF for any path, except for paths containing 'missing' (404) or 'notpdf' (an HTML page),
+# so the harvester's error handling can be tried out too:
+class StandinHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = urllib.parse.urlparse(self.path).path
+        if 'missing' in path:
+            self.send_error(404)
+            return
+        if 'notpdf' in path:
+            body, content_type = b"<html><body>Not a PDF</body></html>", 'text/html'
+        else:
+            body, content_type = make_pdf(["Sample document", f"Served for {path}"]), 'application/pdf'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+def start_server(port=DEFAULT_PORT):
+    server = ThreadingHTTPServer(('127.0.0.1', port), StandinHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Harvest and extract the documents for a set of records from the stand-in (with every document host mapped to it),
+# into a temporary store, checking that every document got its text, and that a second run has nothing left to fetch:
+def check(input_jsonl, workers=8, per_host=2):
+    server = start_server(0)
+    port = server.server_address[1]
+    pubs = list(read_publications_jsonl(input_jsonl))
+    # The sample PDFs aren't the size the sources give:
+    for pub in pubs:
+        pub.size = None
+    hosts = set(f"{url.scheme}://{url.netloc}" for url in (urllib.parse.urlparse(pub.document_url) for pub in pubs if pub.document_url))
+    url_map = { host: f"http://127.0.0.1:{port}" for host in hosts }
+    urls = set(pub.document_url for pub in pubs if pub.document_url)
+    store_dir = tempfile.mkdtemp(prefix='dppi-fulltext-check-')
+    try:
+        store = FulltextStore(store_dir)
+        harvest(pubs, store, workers, per_host, url_map)
+        extract_all(store)
+        failed = [url for url in urls if store.get_text(url) is None]
+        # Everything's in the store now, so a second run shouldn't download anything:
+        store = FulltextStore(store_dir)
+        before = dict(store.documents)
+        harvest(pubs, store, workers, per_host, url_map)
+        refetched = [url for url in urls if store.documents[url] != before[url]]
+    finally:
+        server.shutdown()
+        shutil.rmtree(store_dir, ignore_errors=True)
+    for url in failed:
+        logger.error(f"No text for {url}")
+    for url in refetched:
+        logger.error(f"Fetched {url} again")
+    logger.info(f"Got text for {len(urls) - len(failed)} of {len(urls)} documents from {len(hosts)} hosts, and refetched {len(refetched)}.")
+    return not failed and not refetched
+
+
+# Main for CLI
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # Set up a simpler argument parser:
+    parser = argparse.ArgumentParser(description="Local stand-in for the document hosts, serving sample PDFs, for trying out dppi.fulltext offline.")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    serve_parser = subparsers.add_parser('serve', help="Serve sample PDFs, e.g. for: python -m dppi.fulltext harvest --url-map https://services.phaidra.univie.ac.at=http://localhost:8000 ...")
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    check_parser = subparsers.add_parser('check', help="Harvest and extract the documents for the records from the stand-in, into a temporary store, and check they all come through.")
+    check_parser.add_argument('input_jsonl')
+
+    args = parser.parse_args()
+
+    if args.action == 'serve':
+        server = ThreadingHTTPServer(('127.0.0.1', args.port), StandinHandler)
+        logger.info(f"Serving sample PDFs on http://127.0.0.1:{args.port}/")
+        server.serve_forever()
+    elif args.action == 'check':
+        if not check(args.input_jsonl):
+            sys.exit(1)
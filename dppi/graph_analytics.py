@@ -0,0 +1,327 @@
+import os
+import json
+import random
+import hashlib
+import argparse
+import logging
+from collections import deque
+from . import instrument
+from .instrument import get_report
+from .models import read_publications_jsonl
+from .graph_gen import CoauthorGraph
+from .authors import AuthorIndex, get_creator_names
+
+logger = logging.getLogger(__name__)
+
+# Number of label propagation passes to run before giving up on convergence:
+MAX_LPA_ITERATIONS = 50
+# How many of the most central nodes to list in each yearly summary:
+TOP_N = 10
+# Components bigger than this get an approximate betweenness, from shortest paths starting at a sample of their nodes:
+MAX_EXACT_BETWEENNESS = 2000
+BETWEENNESS_SAMPLES = 500
+
+# Adjacency lists (neighbour ids and link weights) for each node:
+def get_adjacency(graph: CoauthorGraph):
+    adj = [dict() for _ in graph.node_names]
+    for (source, target), value in graph.link_counts.items():
+        adj[source][target] = value
+        adj[target][source] = value
+    return adj
+
+# Connected components, as lists of node ids, largest first:
+def connected_components(adj):
+    seen = [False] * len(adj)
+    components = []
+    for start in range(len(adj)):
+        if seen[start]:
+            continue
+        seen[start] = True
+        component = [start]
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            for neighbour in adj[node]:
+                if not seen[neighbour]:
+                    seen[neighbour] = True
+                    component.append(neighbour)
+                    queue.append(neighbour)
+        components.append(sorted(component))
+    components.sort(key=lambda c: (-len(c), c[0]))
+    return components
+
+# Community labels via (deterministic) weighted label propagation, renumbered so 0 is the largest community:
+def communities(adj, names):
+    labels = list(range(len(adj)))
+    # Visit nodes in a fixed order, so the result is repeatable:
+    order = sorted(range(len(adj)), key=lambda i: names[i])
+    for _ in range(MAX_LPA_ITERATIONS):
+        changed = False
+        for node in order:
+            if not adj[node]:
+                continue
+            weights = {}
+            for neighbour, weight in adj[node].items():
+                weights[labels[neighbour]] = weights.get(labels[neighbour], 0) + weight
+            best = max(weights.values())
+            label = min(l for l, w in weights.items() if w == best)
+            if label != labels[node] and weights.get(labels[node], 0) < best:
+                labels[node] = label
+                changed = True
+        if not changed:
+            break
+    sizes = {}
+    for label in labels:
+        sizes[label] = sizes.get(label, 0) + 1
+    renumber = { label: i for i, label in enumerate(sorted(sizes, key=lambda l: (-sizes[l], l))) }
+    return [renumber[label] for label in labels]
+
+# Raw (unnormalised, undirected) betweenness for the nodes of one component, using Brandes' algorithm,
+# summing the dependencies of the paths from the given sources:
+def component_betweenness(adj, component, sources):
+    scores = { node: 0.0 for node in component }
+    for s in sources:
+        stack = []
+        preds = { s: [] }
+        sigma = { s: 1 }
+        dist = { s: 0 }
+        queue = deque([s])
+        while queue:
+            v = queue.popleft()
+            stack.append(v)
+            for w in adj[v]:
+                if w not in dist:
+                    dist[w] = dist[v] + 1
+                    sigma[w] = 0
+                    preds[w] = []
+                    queue.append(w)
+                if dist[w] == dist[v] + 1:
+                    sigma[w] += sigma[v]
+                    preds[w].append(v)
+        delta = dict.fromkeys(stack, 0.0)
+        while stack:
+            w = stack.pop()
+            for v in preds[w]:
+                delta[v] += sigma[v] / sigma[w] * (1 + delta[w])
+            if w != s:
+                scores[w] += delta[w]
+    # Each path is counted from both ends:
+    return { node: score / 2 for node, score in scores.items() }
+
+# The same, vectorised with numpy: the component is held as a sparse (CSR) adjacency, and each breadth-first search
+# expands a whole level at a time, with the path counts and dependencies summed along the level's links in one go:
+def component_betweenness_numpy(np, adj, component, sources):
+    n = len(component)
+    index = { node: i for i, node in enumerate(component) }
+    degrees = np.array([len(adj[node]) for node in component])
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(degrees, out=indptr[1:])
+    indices = np.array([index[neighbour] for node in component for neighbour in adj[node]], dtype=np.int64)
+    scores = np.zeros(n)
+    for s in (index[node] for node in sources):
+        dist = np.full(n, -1)
+        dist[s] = 0
+        sigma = np.zeros(n)
+        sigma[s] = 1
+        frontier = np.array([s])
+        levels = []
+        depth = 0
+        while len(frontier):
+            # All the links out of the frontier:
+            counts = degrees[frontier]
+            offsets = np.repeat(indptr[frontier] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            targets = indices[offsets]
+            origins = np.repeat(frontier, counts)
+            # Keep the ones that are on shortest paths:
+            dist[targets[dist[targets] < 0]] = depth + 1
+            on_path = dist[targets] == depth + 1
+            origins, targets = origins[on_path], targets[on_path]
+            sigma += np.bincount(targets, weights=sigma[origins], minlength=n)
+            levels.append((origins, targets))
+            frontier = np.unique(targets)
+            depth += 1
+        delta = np.zeros(n)
+        for origins, targets in reversed(levels):
+            delta += np.bincount(origins, weights=sigma[origins] / sigma[targets] * (1 + delta[targets]), minlength=n)
+        delta[s] = 0
+        scores += delta
+    return { node: scores[i] / 2 for i, node in enumerate(component) }
+
+# The sources to sum the betweenness over: all of a component's nodes, or for a big component, a fixed-size sample of them
+# (chosen by name, so the same component gets the same sample), with the scale factor for the sampled scores:
+def betweenness_sources(component, names):
+    if len(component) <= MAX_EXACT_BETWEENNESS:
+        return component, 1.0
+    by_name = sorted(component, key=lambda node: names[node])
+    return sorted(random.Random(0).sample(by_name, BETWEENNESS_SAMPLES)), len(component) / BETWEENNESS_SAMPLES
+
+# A key for a component's structure (by name, as node ids change between runs), so cached results can be reused:
+def component_key(adj, component, names):
+    edges = sorted(
+        (min(names[v], names[w]), max(names[v], names[w]))
+        for v in component for w in adj[v] if v < w
+    )
+    nodes = sorted(names[v] for v in component)
+    return hashlib.sha256(json.dumps([nodes, edges]).encode('utf-8')).hexdigest()
+
+# Betweenness is the expensive bit, so is vectorised with numpy where that's installed (falling back to plain Python),
+# and approximated for very big components. The results are cached per component, so the components a new year
+# doesn't touch are reused as they are (though the largest component usually changes, so that is recomputed):
+def betweenness(adj, components, names, cache):
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+    n = len(adj)
+    scale = 2 / ((n - 1) * (n - 2)) if n > 2 else 1
+    result = [0.0] * n
+    for component in components:
+        if len(component) < 3:
+            continue
+        key = component_key(adj, component, names)
+        if key in cache:
+            get_report().record_cache('betweenness', 'hits')
+        else:
+            get_report().record_cache('betweenness', 'misses')
+            sources, sample_scale = betweenness_sources(component, names)
+            with get_report().timer('betweenness', len(component)):
+                if numpy:
+                    raw = component_betweenness_numpy(numpy, adj, component, sources)
+                else:
+                    raw = component_betweenness(adj, component, sources)
+            cache[key] = { names[node]: score * sample_scale for node, score in raw.items() }
+        for node in component:
+            result[node] = cache[key][names[node]] * scale
+    return result
+
+# Compute all the analytics for a graph:
+def analyse(graph: CoauthorGraph, cache):
+    names = graph.node_names
+    adj = get_adjacency(graph)
+    components = connected_components(adj)
+    component_ids = [0] * len(adj)
+    for i, component in enumerate(components):
+        for node in component:
+            component_ids[node] = i
+    community_ids = communities(adj, names)
+    n = len(adj)
+    between = betweenness(adj, components, names, cache)
+    nodes = []
+    for i, name in enumerate(names):
+        nodes.append({
+            'id': i,
+            'name': name,
+            'count': graph.node_counts[i],
+            'degree': len(adj[i]),
+            'degree_centrality': len(adj[i]) / (n - 1) if n > 1 else 0,
+            'betweenness': between[i],
+            'component': component_ids[i],
+            'community': community_ids[i],
+        })
+    summary = {
+        'nodes': n,
+        'links': len(graph.link_counts),
+        'components': len(components),
+        'largest_component': len(components[0]) if components else 0,
+        'communities': len(set(community_ids)),
+        'top_degree': [nodes[i]['name'] for i in sorted(range(n), key=lambda i: (-nodes[i]['degree'], names[i]))[:TOP_N]],
+        'top_betweenness': [nodes[i]['name'] for i in sorted(range(n), key=lambda i: (-between[i], names[i]))[:TOP_N]],
+    }
+    return summary, nodes
+
+def load_cache(cache_dir):
+    cache_path = os.path.join(cache_dir, 'graph-analytics-cache.json')
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            return json.load(f)
+    return { 'betweenness': {}, 'years': {} }
+
+def save_cache(cache_dir, cache):
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_path = os.path.join(cache_dir, 'graph-analytics-cache.json')
+    with open(f"{cache_path}.tmp", 'w') as f:
+        json.dump(cache, f)
+    os.replace(f"{cache_path}.tmp", cache_path)
+
+# Run the analytics over the whole graph, and over per-year snapshots.
+# Each year's snapshot is cached against a hash of that year's creator lists, so adding a year only computes that year,
+# and betweenness for the whole graph is only recomputed for the components the new year changes:
+def run_analytics(input_jsonl, cache, authors=None):
+    graph = CoauthorGraph()
+    creators_by_year = {}
+    for pub in get_report().track('read', read_publications_jsonl(input_jsonl)):
+        creators = get_creator_names(pub, authors)
+        graph.add(creators)
+        creators_by_year.setdefault(pub.year, []).append(creators)
+
+    logger.info(f"Analysing graph of {len(graph.node_names)} nodes and {len(graph.link_counts)} links...")
+    with get_report().timer('analyse', len(graph.node_names)):
+        summary, nodes = analyse(graph, cache['betweenness'])
+
+    years = {}
+    for year in sorted(creators_by_year):
+        key = hashlib.sha256(json.dumps(creators_by_year[year]).encode('utf-8')).hexdigest()
+        cached = cache['years'].get(str(year))
+        if cached and cached['key'] == key:
+            get_report().record_cache('years', 'hits')
+            years[str(year)] = cached['result']
+            continue
+        get_report().record_cache('years', 'misses')
+        logger.info(f"Analysing the {year} snapshot...")
+        year_graph = CoauthorGraph()
+        for creators in creators_by_year[year]:
+            year_graph.add(creators)
+        with get_report().timer('years', len(year_graph.node_names)):
+            year_summary, year_nodes = analyse(year_graph, {})
+        result = {
+            'summary': year_summary,
+            'nodes': year_nodes,
+            'links': year_graph.to_d3()['links'],
+        }
+        cache['years'][str(year)] = { 'key': key, 'result': result }
+        years[str(year)] = result
+
+    # Drop cached betweenness for components that no longer exist, so the cache doesn't grow forever:
+    live = set()
+    adj = get_adjacency(graph)
+    for component in connected_components(adj):
+        if len(component) >= 3:
+            live.add(component_key(adj, component, graph.node_names))
+    cache['betweenness'] = { key: value for key, value in cache['betweenness'].items() if key in live }
+
+    return graph, {
+        'summary': summary,
+        'nodes': nodes,
+        'years': years,
+    }
+
+
+# Main for CLI
+if __name__ == "__main__":
+    # Set up a simpler argument parser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input_jsonl')
+    parser.add_argument('output_json', help="Where to write the analytics results.")
+    parser.add_argument('--graph-json', help="Also write the D3 nodes/links graph, with the community as the node group.")
+    parser.add_argument('--cache-dir', help="Folder to cache results in, so only what has changed gets recomputed.")
+    parser.add_argument('--authors', help="Author index JSON file (as written by the merger), so name variants become a single node.")
+    instrument.add_arguments(parser)
+
+    args = parser.parse_args()
+    instrument.start(args, 'graph_analytics')
+
+    cache = load_cache(args.cache_dir) if args.cache_dir else { 'betweenness': {}, 'years': {} }
+    graph, results = run_analytics(args.input_jsonl, cache, AuthorIndex.load(args.authors) if args.authors else None)
+    if args.cache_dir:
+        save_cache(args.cache_dir, cache)
+
+    with get_report().timer('write'):
+        with open(args.output_json, 'w') as f:
+            json.dump(results, f)
+
+        if args.graph_json:
+            data = graph.to_d3()
+            for node in data['nodes']:
+                node['group'] = results['nodes'][node['id']]['community']
+            with open(args.graph_json, 'w') as f:
+                json.dump(data, f)
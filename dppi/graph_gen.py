@@ -1,10 +1,87 @@
-import urllib.request
 import argparse
 import json
-import os.path
-from .models import Publication
-import frontmatter
-from slugify import slugify
+from . import instrument
+from .instrument import get_report
+from .models import read_publications_jsonl
+from .authors import AuthorIndex, get_creator_names
+
+# Builds up the co-authorship graph in a single pass over the publications, using a name->id dict for the nodes
+# and counting the links as each publication's creator pairs are generated:
+class CoauthorGraph:
+    def __init__(self):
+        self.node_ids = {}
+        self.node_names = []
+        self.node_counts = []
+        self.link_counts = {}
+
+    def node_id(self, name):
+        node_id = self.node_ids.get(name)
+        if node_id is None:
+            node_id = len(self.node_names)
+            self.node_ids[name] = node_id
+            self.node_names.append(name)
+            self.node_counts.append(0)
+        return node_id
+
+    def add(self, creators):
+        ids = [self.node_id(creator) for creator in creators]
+        for node_id in ids:
+            self.node_counts[node_id] += 1
+        # Count all combinations, excluding self-matches:
+        for x, x_id in zip(creators, ids):
+            for y, y_id in zip(creators, ids):
+                if x > y:
+                    key = (x_id, y_id)
+                    self.link_counts[key] = self.link_counts.get(key, 0) + 1
+
+    # The D3-style nodes/links form:
+    def to_d3(self):
+        nodes = [
+            { 'id': i, 'name': name, 'count': self.node_counts[i], 'group': 0 }
+            for i, name in enumerate(self.node_names)
+        ]
+        links = [
+            { 'source': source, 'target': target, 'value': value }
+            for (source, target), value in self.link_counts.items()
+        ]
+        return { 'nodes': nodes, 'links': links }
+
+    # The (symmetric) adjacency matrix, in sparse COO form:
+    def to_coo(self):
+        row, col, data = [], [], []
+        for (source, target), value in self.link_counts.items():
+            row += [source, target]
+            col += [target, source]
+            data += [value, value]
+        return {
+            'shape': [len(self.node_names), len(self.node_names)],
+            'row': row,
+            'col': col,
+            'data': data,
+            'names': self.node_names,
+        }
+
+# Build the graph from a JSONL file of publications, using the canonical author names if there's an author index:
+def build_graph(input_jsonl, authors=None):
+    graph = CoauthorGraph()
+    for pub in get_report().track('read', read_publications_jsonl(input_jsonl)):
+        with get_report().timer('graph'):
+            graph.add(get_creator_names(pub, authors))
+    return graph
+
+# Write the COO arrays, as a NumPy .npz file if the path ends with .npz, or as JSON otherwise:
+def write_coo(coo, output_path):
+    if output_path.endswith('.npz'):
+        import numpy as np
+        np.savez_compressed(output_path,
+            shape=np.array(coo['shape']),
+            row=np.array(coo['row'], dtype=np.int32),
+            col=np.array(coo['col'], dtype=np.int32),
+            data=np.array(coo['data'], dtype=np.int32),
+            names=np.array(coo['names']))
+    else:
+        with open(output_path, 'w') as f:
+            json.dump(coo, f)
 
 # Main for CLI
 if __name__ == "__main__":
@@ -12,66 +89,22 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('input_jsonl')
     parser.add_argument('output_json')
+    parser.add_argument('--coo', help="Also write the adjacency matrix in sparse COO form to this file (.npz requires NumPy, otherwise JSON).")
+    parser.add_argument('--authors', help="Author index JSON file (as written by the merger), so name variants become a single node.")
+
+    instrument.add_arguments(parser)
 
     args = parser.parse_args()
+    instrument.start(args, 'graph_gen')
 
-    # Open the source JSONL, convert to a suitably-named Markdown+frontmatter file:
-    pubs = []
-    with open(args.input_jsonl) as in_file:
-        for line in in_file:
-            pub = Publication.model_validate_json(line)
-            pubs.append(pub)
-
-    # Process for unique nodes:
-    creator_counts = {}
-    for pub in pubs:
-        for creator in pub.creators:
-            creator_counts[creator] = creator_counts.get(creator, 0) + 1
-    node_index = list(creator_counts.keys())
-    #print(node_index)
-
-    # Build up the node list:
-    node_list = []
-    for i, name in enumerate(node_index):
-        node_list.append( { 
-            'id': i,
-            'name': node_index[i],
-            'count': creator_counts[node_index[i]],
-            'group': 0
-        })
-    #print(node_list)
-
-    # Now build a hash of the sets of links, to accumulate the total pubs for each pairing
-    # Loop over all publications for the links:
-    combos = []
-    for pub in pubs:
-        # Generate all combinations, excluding self-matches:
-        combos += [(x,y) for x in pub.creators for y in pub.creators if x > y]
-    # And turn into link counts:
-    links_counts = {}
-    for combo in combos:
-        links_counts[combo] = links_counts.get(combo, 0) + 1
-    #print(links_counts)
-
-    # Convert this into the right form:
-    links = []
-    for link_key in links_counts:
-        source, target = link_key
-        link = {
-            'source': node_index.index(source),
-            'target': node_index.index(target),
-            'value' : links_counts[link_key]
-        }
-        links.append(link)
+    graph = build_graph(args.input_jsonl, AuthorIndex.load(args.authors) if args.authors else None)
 
-    # Assemble the data:
-    data = {
-        'nodes': node_list,
-        'links': links
-    }
+    with get_report().timer('write', len(graph.node_names)):
+        with open(args.output_json, 'w') as f:
+            json.dump(graph.to_d3(), f)
 
-    with open(args.output_json, 'w') as f:
-        json.dump(data, f)
+        if args.coo:
+            write_coo(graph.to_coo(), args.coo)
 """
 
 // Now the links...
@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter, Retry
+from .instrument import get_report
+
+logger = logging.getLogger(__name__)
+
+# Defaults, which can be overridden via the environment so all the fetchers pick them up:
+DEFAULT_CACHE_DIR = os.environ.get('DPPI_HTTP_CACHE_DIR', '.http-cache')
+DEFAULT_MAX_SIZE = int(os.environ.get('DPPI_HTTP_CACHE_MAX_SIZE', 1024*1024*1024))
+DEFAULT_OFFLINE = os.environ.get('DPPI_HTTP_OFFLINE', '') not in ('', '0')
+# Size of the connection pool for the shared session, which should be at least the number of worker threads using it:
+DEFAULT_POOL_SIZE = 16
+# How long a cached response is used without revalidating it, unless the caller says otherwise:
+DEFAULT_TTL = 24*60*60
+
+class CacheMiss(Exception):
+    pass
+
+# Set up a keep-alive session with a connection pool, and polite retries with backoff:
+def make_session(pool_size=DEFAULT_POOL_SIZE, retries=5, backoff_factor=1):
+    s = requests.Session()
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=[429, 500, 502, 503, 504])
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    return s
+
+# A minimal requests.Response look-alike, for both cached and fresh responses:
+class CachedResponse:
+    def __init__(self, url, status_code, headers, content, from_cache=False):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.from_cache = from_cache
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error for {self.url}")
+
+# On-disk HTTP cache, storing bodies plus ETag/Last-Modified, revalidated using conditional GETs.
+# POST responses (e.g. the Phaidra Solr queries) are cached too, keyed on the request body, but servers don't honour
+# conditional POSTs, so these are just used until their TTL runs out and then fetched again in full.
+# The total size of the cached bodies is bounded, evicting the least-recently used entries first. Each use of an entry
+# touches its body file, so the files' modification times give the order they were last used in, without rewriting anything.
+class HttpCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE, session=None, offline=DEFAULT_OFFLINE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.session = session or make_session()
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.total_size = None
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+    def _paths(self, key):
+        folder = os.path.join(self.cache_dir, key[:2])
+        return os.path.join(folder, f"{key}.json"), os.path.join(folder, f"{key}.body")
+
+    def _key(self, method, url, params, data):
+        if params:
+            url = f"{url}{'&' if '?' in url else '?'}{urllib.parse.urlencode(params)}"
+        if isinstance(data, dict):
+            data = urllib.parse.urlencode(data)
+        h = hashlib.sha256(f"{method} {url}\n".encode('utf-8'))
+        if data:
+            h.update(data if isinstance(data, bytes) else data.encode('utf-8'))
+        return h.hexdigest()
+
+    def _load(self, key):
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                content = f.read()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None, None
+        return meta, content
+
+    # Write a file via a uniquely-named temporary file, as several threads can be writing the same entry at once:
+    def _write_file(self, path, content):
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix='.tmp', delete=False) as f:
+            f.write(content)
+        os.replace(f.name, path)
+
+    def _write_meta(self, key, meta):
+        meta_path, _ = self._paths(key)
+        self._write_file(meta_path, json.dumps(meta).encode('utf-8'))
+
+    def _store(self, key, meta, content):
+        meta_path, body_path = self._paths(key)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        # When replacing an entry, only the difference in size counts towards the total:
+        try:
+            previous_size = os.path.getsize(body_path)
+        except FileNotFoundError:
+            previous_size = 0
+        self._write_file(body_path, content)
+        self._write_meta(key, meta)
+        with self.lock:
+            if self.total_size is not None:
+                self.total_size += len(content) - previous_size
+        self._evict()
+
+    # Mark an entry as just used:
+    def _touch(self, key):
+        _, body_path = self._paths(key)
+        try:
+            os.utime(body_path)
+        except FileNotFoundError:
+            pass
+
+    # Drop the least-recently-used entries until the cache is back under the size limit:
+    def _evict(self):
+        with self.lock:
+            if self.total_size is not None and self.total_size <= self.max_size:
+                return
+            entries = self._list_entries()
+            self.total_size = sum(meta['size'] for meta in entries.values())
+            for key, meta in sorted(entries.items(), key=lambda item: item[1]['last_used']):
+                if self.total_size <= self.max_size:
+                    break
+                for path in self._paths(key):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.total_size -= meta['size']
+                logger.debug("Evicted %s from the HTTP cache.", meta['url'])
+
+    def _list_entries(self):
+        entries = {}
+        if not os.path.exists(self.cache_dir):
+            return entries
+        for folder in os.listdir(self.cache_dir):
+            folder_path = os.path.join(self.cache_dir, folder)
+            if not os.path.isdir(folder_path):
+                continue
+            for name in os.listdir(folder_path):
+                if name.endswith('.json'):
+                    try:
+                        with open(os.path.join(folder_path, name)) as f:
+                            meta = json.load(f)
+                        meta['last_used'] = os.path.getmtime(os.path.join(folder_path, f"{name[:-5]}.body"))
+                        entries[name[:-5]] = meta
+                    except (FileNotFoundError, json.JSONDecodeError):
+                        pass
+        return entries
+
+    def _count(self, outcome):
+        with self.lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+        get_report().record_cache('http', outcome)
+
+    def _response(self, meta, content, from_cache):
+        return CachedResponse(meta['url'], meta['status_code'], meta['headers'], content, from_cache=from_cache)
+
+    def request(self, method, url, params=None, data=None, ttl=DEFAULT_TTL, headers=None, **kwargs):
+        key = self._key(method, url, params, data)
+        meta, content = self._load(key)
+        now = time.time()
+
+        # Use the cached version if it's still fresh, or if we're offline:
+        if meta is not None and (self.offline or now - meta['fetched_at'] < ttl):
+            self._count('hits')
+            self._touch(key)
+            return self._response(meta, content, True)
+        if self.offline:
+            raise CacheMiss(f"No cached response for {method} {url} and running offline!")
+
+        # Otherwise, (re)validate (conditional requests only work for GETs):
+        headers = dict(headers or {})
+        if meta is not None and method in ('GET', 'HEAD'):
+            if meta['headers'].get('ETag'):
+                headers['If-None-Match'] = meta['headers']['ETag']
+            if meta['headers'].get('Last-Modified'):
+                headers['If-Modified-Since'] = meta['headers']['Last-Modified']
+        start = time.perf_counter()
+        r = self.session.request(method, url, params=params, data=data, headers=headers, **kwargs)
+        get_report().record_http(method, url, time.perf_counter() - start, r.status_code)
+
+        if r.status_code == 304 and meta is not None:
+            self._count('revalidated')
+            meta['fetched_at'] = now
+            self._write_meta(key, meta)
+            self._touch(key)
+            return self._response(meta, content, True)
+
+        self._count('misses')
+        meta = {
+            'url': r.url,
+            'status_code': r.status_code,
+            'headers': { name: r.headers[name] for name in ('Content-Type', 'ETag', 'Last-Modified') if name in r.headers },
+            'fetched_at': now,
+            'size': len(r.content),
+        }
+        # Only successful responses get cached:
+        if r.status_code == 200:
+            self._store(key, meta, r.content)
+        return self._response(meta, r.content, False)
+
+    def get(self, url, params=None, ttl=DEFAULT_TTL, **kwargs):
+        return self.request('GET', url, params=params, ttl=ttl, **kwargs)
+
+    def post(self, url, data=None, ttl=DEFAULT_TTL, **kwargs):
+        return self.request('POST', url, data=data, ttl=ttl, **kwargs)
+
+# Shared instance, so all the fetchers in a process use the same cache:
+_http_cache = None
+
+def get_http_cache():
+    global _http_cache
+    if _http_cache is None:
+        _http_cache = HttpCache()
+    return _http_cache
+
+# Replace the shared instance, e.g. to use a separate cache folder:
+def set_http_cache(cache):
+    global _http_cache
+    _http_cache = cache
+    return cache
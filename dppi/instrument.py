@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import atexit
+import logging
+import pstats
+import cProfile
+import resource
+import threading
+import tracemalloc
+import urllib.parse
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Number of allocation sites to list in the tracemalloc dump:
+PROFILE_TOP_ALLOCATIONS = 50
+
+# Collects what happened during a run: time spent and records handled per stage (or source), HTTP requests and latency
+# per host, cache hits and misses, and peak memory.
+#
+# Stage times are exclusive, i.e. when stages are nested (e.g. the dedup stage pulling records from the source readers),
+# the time spent in the inner stage is not counted again in the outer one, so the stage times add up to the total.
+# The nesting is tracked with a stack, so timer() and track() are meant for the main thread. Threads, coroutines
+# and worker processes should measure for themselves and use add(), in which case the times can overlap.
+class RunReport:
+    def __init__(self, command=None):
+        self.command = command
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.http = {}
+        self.caches = {}
+        self.lock = threading.Lock()
+        self.stack = []
+
+    def add(self, name, seconds=0.0, count=0):
+        with self.lock:
+            stage = self.stages.setdefault(name, { 'seconds': 0.0, 'count': 0 })
+            stage['seconds'] += seconds
+            stage['count'] += count
+
+    # Remove a stage and return its stats, e.g. to send them back from a worker process:
+    def pop_stage(self, name):
+        with self.lock:
+            return self.stages.pop(name, { 'seconds': 0.0, 'count': 0 })
+
+    def _enter(self):
+        self.stack.append(0.0)
+        return time.perf_counter()
+
+    def _exit(self, name, start, count):
+        elapsed = time.perf_counter() - start
+        nested = self.stack.pop()
+        if self.stack:
+            self.stack[-1] += elapsed
+        self.add(name, elapsed - nested, count)
+
+    # Time a block of code as (part of) a stage:
+    @contextmanager
+    def timer(self, name, count=1):
+        start = self._enter()
+        try:
+            yield
+        finally:
+            self._exit(name, start, count)
+
+    # Pass through a stream of records, timing how long it takes to produce each one, and counting them:
+    def track(self, name, items):
+        items = iter(items)
+        while True:
+            start = self._enter()
+            try:
+                item = next(items)
+            except StopIteration:
+                self._exit(name, start, 0)
+                return
+            except BaseException:
+                self._exit(name, start, 0)
+                raise
+            self._exit(name, start, 1)
+            yield item
+
+    # Record an HTTP request that went over the network:
+    def record_http(self, method, url, seconds, status_code):
+        host = urllib.parse.urlparse(url).netloc
+        with self.lock:
+            stats = self.http.setdefault(host, { 'requests': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0 })
+            stats['requests'] += 1
+            stats['seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+            if status_code >= 400:
+                stats['errors'] += 1
+
+    # Record the outcome of a cache lookup, e.g. record_cache('http', 'hits'):
+    def record_cache(self, cache, outcome, count=1):
+        with self.lock:
+            outcomes = self.caches.setdefault(cache, {})
+            outcomes[outcome] = outcomes.get(outcome, 0) + count
+
+    def to_dict(self):
+        seconds = time.perf_counter() - self.start
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        with self.lock:
+            stages = {
+                name: { **stage, 'per_second': stage['count'] / stage['seconds'] if stage['seconds'] else None }
+                for name, stage in self.stages.items()
+            }
+            http = {
+                host: { **stats, 'mean_seconds': stats['seconds'] / stats['requests'] }
+                for host, stats in self.http.items()
+            }
+            caches = {
+                cache: { **outcomes, 'hit_rate': outcomes.get('hits', 0) / sum(outcomes.values()) }
+                for cache, outcomes in self.caches.items()
+            }
+        return {
+            'command': self.command,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started)),
+            'seconds': seconds,
+            'cpu_seconds': usage.ru_utime + usage.ru_stime + children.ru_utime + children.ru_stime,
+            # ru_maxrss is in KB on Linux:
+            'peak_rss_mb': usage.ru_maxrss / 1024,
+            'children_peak_rss_mb': children.ru_maxrss / 1024,
+            'stages': stages,
+            'http': http,
+            'caches': caches,
+        }
+
+    def write(self, output_path):
+        with open(f"{output_path}.tmp", 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(f"{output_path}.tmp", output_path)
+
+# Shared instance, so all the modules in a process record into the same report:
+_report = RunReport()
+
+def get_report():
+    return _report
+
+# Add the shared instrumentation options to a CLI:
+def add_arguments(parser):
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help="Logging level (default: INFO).")
+    parser.add_argument('--report', help="Write a JSON run report to this file, with the time taken and records handled per stage, HTTP and cache stats, and peak memory.")
+    parser.add_argument('--profile', help="Profile the run with cProfile and tracemalloc, writing PROFILE.prof (for pstats/snakeviz) and PROFILE.memory.txt (top allocation sites).")
+
+# Set up logging for a CLI, and start the run report and profilers as requested.
+# The results are written out when the process exits, so runs that bail out early get reported too:
+def start(args, command):
+    logging.basicConfig(level=getattr(logging, args.log_level))
+    _report.command = command
+    profiler = None
+    if args.profile:
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    atexit.register(finish, os.getpid(), args.report, args.profile, profiler)
+
+def finish(pid, report_path, profile_prefix, profiler):
+    # Forked worker processes inherit the exit handler, but only the main process should report:
+    if os.getpid() != pid:
+        return
+    if profiler:
+        profiler.disable()
+        pstats.Stats(profiler).dump_stats(f"{profile_prefix}.prof")
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with open(f"{profile_prefix}.memory.txt", 'w') as f:
+            f.write(f"Peak traced memory: {peak / (1024*1024):.1f}MB\n\n")
+            for stat in snapshot.statistics('lineno')[:PROFILE_TOP_ALLOCATIONS]:
+                f.write(f"{stat}\n")
+        logger.info(f"Wrote profile to {profile_prefix}.prof and {profile_prefix}.memory.txt")
+    if report_path:
+        _report.write(report_path)
+        logger.info(f"Wrote run report to {report_path}")
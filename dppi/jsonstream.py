@@ -0,0 +1,130 @@
+import json
+
+# How much of the file to read at a time:
+CHUNK_SIZE = 64*1024
+
+_decoder = json.JSONDecoder()
+
+# A minimal incremental JSON reader, that can walk down to an array inside a (possibly very large) JSON document
+# and yield its items one at a time, while only holding roughly one item in memory.
+class JsonStream:
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    # Read more of the file into the buffer, dropping the part that's already been consumed:
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    # Get the next non-whitespace character, without consuming it:
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON input!")
+
+    def expect(self, c):
+        if self.peek() != c:
+            raise ValueError(f"Expected '{c}' but found '{self.buf[self.pos]}' in JSON input!")
+        self.pos += 1
+
+    # Decode the next complete value, reading more of the file until it's all in the buffer:
+    def decode(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # A number is only complete if it's followed by a delimiter, as it might continue in the next chunk:
+                if self.eof or not isinstance(value, (int, float)) or (end < len(self.buf) and self.buf[end] in ',]} \t\r\n'):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    # Skip over the next value without decoding it, so large values we don't need aren't held in memory:
+    def skip(self):
+        self.peek()
+        depth = 0
+        in_string = False
+        escaped = False
+        while True:
+            while self.pos < len(self.buf):
+                c = self.buf[self.pos]
+                self.pos += 1
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif c == '\\':
+                        escaped = True
+                    elif c == '"':
+                        in_string = False
+                        if depth == 0:
+                            return
+                elif depth == 0 and c in ',}] \t\r\n':
+                    # End of a bare literal (number, true, false, null):
+                    self.pos -= 1
+                    return
+                elif c == '"':
+                    in_string = True
+                elif c in '{[':
+                    depth += 1
+                elif c in '}]':
+                    depth -= 1
+                    if depth == 0:
+                        return
+            if not self._fill():
+                if depth == 0 and not in_string:
+                    return
+                raise ValueError("Unexpected end of JSON input!")
+
+    # Walk down through the objects to the value under the given keys:
+    def descend(self, path):
+        for key in path:
+            self.expect('{')
+            while True:
+                if self.peek() == '}':
+                    raise KeyError(key)
+                name = self.decode()
+                self.expect(':')
+                if name == key:
+                    break
+                self.skip()
+                if self.peek() == ',':
+                    self.pos += 1
+
+    # Yield the items of the array at the current position:
+    def iter_array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.peek() == ',':
+                self.pos += 1
+            else:
+                self.expect(']')
+                return
+
+# Yield the items from the array under the given keys of a JSON file, one at a time:
+def iter_json_array(input_file, path, chunk_size=CHUNK_SIZE, opener=open):
+    with opener(input_file) as f:
+        stream = JsonStream(f, chunk_size)
+        stream.descend(path)
+        yield from stream.iter_array()
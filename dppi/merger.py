@@ -6,20 +6,39 @@ import json
 import argparse
 import datetime
 import logging
-from .models import Publication
+import hashlib
+import shutil
+import functools
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from . import models, jsonstream, rules, instrument
+from .models import Publication, PubPathIndex, serialise_publication, read_publications_jsonl
+from awindex.models import IndexRecord
+from .jsonstream import iter_json_array
+from .dedup import Deduplicator
+from .authors import AuthorIndex
+from .snapshots import open_source, list_sources, source_hash
+from .rules import PHAIDRA_RULES, EVENTSAIR_RULES, OSF_FILE_RULES, take_rule_hits
+from .instrument import get_report
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 INST_RE = re.compile("^(.*) \((.*)\)$")
-TITLE_END_1_RE = re.compile(r"(:|-) (iPres|iPRES|iPES) \d{4} (: |- |– |)[a-zA-Z, ]+$")
-TITLE_END_2_RE = re.compile(r"(:|-) ([a-zA-Z ]+) (:|-) (iPres|iPRES) \d{4} (:|-) [a-zA-Z, ]+$")
+RECORDING_RE = re.compile(r"Recording: ([^ ]+)", re.MULTILINE)
 DEFAULT_LICENSE = "CC-BY 4.0 International"
+YEAR_RE = re.compile(r"(\d{4})")
+# Cached shards are invalidated when the code in these modules changes:
+READER_MODULES = [__file__, models.__file__, jsonstream.__file__, rules.__file__]
+SHARD_MANIFEST = 'manifest.json'
+# Fields with only a few distinct values, which are dictionary-encoded in the Parquet output:
+PARQUET_DICTIONARY_FIELDS = ['type', 'license', 'language']
+# Number of records per Parquet row group:
+PARQUET_ROW_GROUP_SIZE = 10000
 
 # Normalised data item generators:
     
 def normalise_phaidra_jsonl(input_path):
-    with open(input_path) as f:
+    with open_source(input_path) as f:
         for line in f:
             doc = json.loads(line) 
             nd = Publication(
@@ -41,26 +60,8 @@ def normalise_phaidra_jsonl(input_path):
                 size = int(doc['size']),
             )
             # TBC: dc_license, dc_subject_eng, size, tcreated, tmodified, __source_col_id
-            # Drop invalid/empty abstracts:
-            if nd.abstract == 'x':
-                nd.abstract = None
-            # Catch how Lightning Talks are indicated:
-            if nd.abstract == 'Lightning Talk':
-                nd.type = 'lightning talk'
-                nd.abstract = None
-            # Distinguish posters based on title or phrase in abstract:
-            if ": Poster " in nd.title or " (Poster) " in nd.title or \
-                (nd.abstract and ("this poster" in nd.abstract.lower() \
-                                     or "the poster" in nd.abstract.lower() \
-                                        or "our poster" in nd.abstract.lower())):
-                nd.type = "poster"
-            # Clean up titles, using any useful metadata in the title:
-            m = TITLE_END_2_RE.search(nd.title)
-            logger.debug(f"Processing PHAIDRA article \"{nd.title}\"...")
-            if m:
-                nd.type = m.group(2).lower()
-                nd.title = TITLE_END_2_RE.sub("", nd.title)
-            nd.title = TITLE_END_1_RE.sub("", nd.title)
+            # Classify, and clean up the abstract and title, using any useful metadata in the title:
+            PHAIDRA_RULES.apply(nd)
             # Shift institutions to separate field if present:
             creators = list()
             insts = list()
@@ -85,13 +86,9 @@ def normalise_phaidra_jsonl(input_path):
             yield nd
 
 def normalise_eventsair_json(input_file):
-    # Some strings to strip from title:
-    to_remove = ['Short Paper: ', 'Long Paper: ', 'Workshop: ', 'Panel: ', 'Poster: ', 'Tutorial: ', 'TUTORIAL: ']
-    # Read the file:
-    with open(input_file) as input:
-        events = json.load(input)
+    # Stream the agenda items from the file:
     counter = 0
-    for item in events['AgendaData']['AgendaItems']:
+    for item in iter_json_array(input_file, ['AgendaData', 'AgendaItems'], opener=open_source):
         if len(item['Speakers']) > 0:
             # Reset fields so they don't get copied:
             abstract = None
@@ -105,17 +102,13 @@ def normalise_eventsair_json(input_file):
                         keywords = doc['PlainText'].replace("<br />"," ").split(", ")
                     elif doc['Name'] == 'Proposal Document':
                         source_url = doc['Url']
-                # Tidy the title:
-                title = speaker['PresenationTitle'] # Mis-spelling is required!
-                for rem in to_remove:
-                    title = title.replace(rem,"")
                 # Create the pub
                 counter += 1
                 d = Publication(
                     source_name=f'iPRES:ea2022:{counter}',
                     year=2022,
                     language='eng',
-                    title=title, 
+                    title=speaker['PresenationTitle'], # Mis-spelling is required!
                     creators=[f"{speaker['FirstName']} {speaker['LastName']}"],
                     institutions=[speaker['Organization']],
                     license=DEFAULT_LICENSE,
@@ -125,20 +118,19 @@ def normalise_eventsair_json(input_file):
                     abstract=abstract,
                     type='unknown',
                     )
-                # Handle type:
-                types = [ "Panel", "Tutorial", "Workshop", "Long Paper", "Short Paper", "Poster" ]
-                for type in types:
-                    if speaker['PresenationTitle'].startswith(f"{type}: "):
-                        d.type = type.lower()
+                # Handle type, and tidy the title:
+                EVENTSAIR_RULES.apply(d)
                 yield d
 
+# Memoised, so the EventsAir file is only parsed once per run:
+@functools.lru_cache(maxsize=None)
 def get_ipres2022_mapping(zotero_path):
     # Read in the mapping file:
     mapping = {}
     mapping_path = zotero_path.replace(".zotero.jsonl", ".eventsair-osf-mapping.csv")
-    mapping_reader = csv.DictReader(open(mapping_path))
-    for row in mapping_reader:
-        mapping[row['ea_id']] = row['osf_id']
+    with open_source(mapping_path, newline='') as mapping_file:
+        for row in csv.DictReader(mapping_file):
+            mapping[row['ea_id']] = row['osf_id']
     # Read in the EventsAir items:
     ea = {}
     ea_path = zotero_path.replace(".zotero.jsonl", ".eventsair.json")
@@ -159,7 +151,7 @@ def normalise_zotero_jsonl(input_path):
     # Self reference to be stored under this key:
     self_key = 'links_self_href'
     # Loop through Zotero items:
-    with open(input_path) as f:
+    with open_source(input_path) as f:
         for line in f:
             item = json.loads(line)
             data = item['data']
@@ -198,21 +190,22 @@ def normalise_zotero_jsonl(input_path):
                 landing_page = att['landing_page']
                 for osf_file in att['osf_files']['data']:
                     title = osf_file['attributes']['name']
-                    if title.startswith('iPres22_Biography_') or title.startswith('iPres22_Holding-Slide'):
-                        logger.info(f"Skipping OSF File: {title}")
-                    elif title.startswith('iPres22_Abstract_') or re.search("iPres22_.. Transcript_", title) or title.startswith('iPres22_Posters_') or title.startswith('iPres22_Video-Transcript_') or title.startswith('iPres22_Memo_'):
-                        logger.warning(f"Skipping OSF File: {title} <<< Should do something with this!?")
-                    elif title.startswith('iPres22_Slides_') or title.startswith('iPres22_LightningTalk_') or title.startswith('iPres22_Poster_'):
+                    rule = OSF_FILE_RULES.match('name', title)
+                    if rule is None:
+                        logger.fatal(f"Unknown OSF File attachment! :: {json.dumps(osf_file)}")
+                        sys.exit(42) # The Answer
+                    elif rule['link'] == 'slides_url':
                         slides_url = osf_file['links']['download']
-                    elif title.startswith('iPres22_Collaborative-Notes'):
+                    elif rule['link'] == 'notes_url':
                         notes_url = osf_file['links']['download']
-                    elif title.startswith('iPres22_Long-Paper_') or title.startswith('iPres22_Short-Paper_') or title.startswith('iPres22_Panel_') or title.startswith('iPres22_Tutorial_') or title.startswith('iPres22_Workshop_') or title.startswith('iPres22_Poster-Proposal_'):
+                    elif rule['link'] == 'document_url':
                         document_url = osf_file['links']['download']
-                    elif title.startswith('iPres22_Recording_') or title.startswith('iPres22_Poster-Video_'):
+                    elif rule['link'] == 'stream_url':
                         stream_url = osf_file['links']['download']
+                    elif rule.get('unused'):
+                        logger.warning(f"Skipping OSF File: {title} <<< Should do something with this!?")
                     else:
-                        logger.fatal(f"Unknown OSF File attachment! :: {json.dumps(osf_file)}")
-                        sys.exit(42) # The Answer
+                        logger.info(f"Skipping OSF File: {title}")
             else:
                 # Handle imported files:
                 if att['linkMode'] == 'imported_file' and att['title'] != 'Snapshot':
@@ -224,8 +217,7 @@ def normalise_zotero_jsonl(input_path):
             creators.append(f"{creator['firstName']} {creator['lastName']}")
         # Extract the YouTube stream URL from the abstract (if needed?):
         if not stream_url and "Recording: " in data['abstractNote']:
-            r = re.compile(r"Recording: ([^ ]+)", re.MULTILINE)
-            m = r.search(data['abstractNote'])
+            m = RECORDING_RE.search(data['abstractNote'])
             stream_url = m.group(1)
         # Construct the item:
         d = Publication(
@@ -278,7 +270,7 @@ def normalise_ideals_jsonl(input_path):
     papers = {}
     presentations = []
     presentation_marker = ' [presentation]'
-    with open(input_path) as f:
+    with open_source(input_path) as f:
         for line in f:
             doc = json.loads(line)
             creators = []
@@ -327,7 +319,7 @@ def normalise_ideals_jsonl(input_path):
         yield papers[canon]
 
 def normalise_ghent_csv(input_file):
-    with open(input_file, encoding='utf-8-sig') as csv_file:
+    with open_source(input_file, encoding='utf-8-sig') as csv_file:
         reader = csv.DictReader(csv_file)
         for item in reader:
             # Skip non-publications:
@@ -394,21 +386,348 @@ def common_cleanup(nd: Publication):
     # Return the modified item:
     return nd
 
-# Helper to generate a CSV version of the data:
-def write_jsonl_to_csv(input_path, output_path):
-    with open(input_path) as f:
-        with open(output_path, 'w+') as outf:
-            counter = 0
-            writer = None
-            for line in f:
-                doc = json.loads(line)
-                # If this is the first pass, set the writer up:
-                if counter == 0:
-                    writer = csv.DictWriter(outf, doc.keys())
-                    writer.writeheader()
-                # write the actual data:
-                writer.writerow(doc)
-                counter += 1
+# Output stage: each record is serialised once, with the Awesome Indexes form derived from that, and fanned out to all the sinks in a single pass.
+
+# The fields for each output format, taken from the schema, so the CSV columns don't depend on the data:
+def get_format_fields(format_type):
+    if format_type == 'awindex':
+        return list(IndexRecord.model_fields.keys())
+    else:
+        return list(Publication.model_fields.keys())
+
+# Sink for JSON Lines output:
+class JsonlSink:
+    def __init__(self, output_path, format_type='dppi'):
+        self.format_type = format_type
+        self.outfile = open(output_path, 'w')
+
+    def write(self, data):
+        # Compact form, matching the output of model_dump_json:
+        self.outfile.write(json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+        self.outfile.write('\n')
+
+    def close(self):
+        self.outfile.close()
+
+# Sink for CSV output, with list and dict fields explicitly encoded as JSON:
+class CsvSink:
+    def __init__(self, output_path, format_type='dppi'):
+        self.format_type = format_type
+        self.outfile = open(output_path, 'w', newline='')
+        self.writer = csv.DictWriter(self.outfile, get_format_fields(format_type))
+        self.writer.writeheader()
+
+    def write(self, data):
+        row = {}
+        for key, value in data.items():
+            if isinstance(value, (list, dict)):
+                value = json.dumps(value, ensure_ascii=False)
+            row[key] = value
+        self.writer.writerow(row)
+
+    def close(self):
+        self.outfile.close()
+
+# The Arrow type for each Publication field, going by the schema (all columns are nullable):
+def get_arrow_schema(pa, exclude=()):
+    fields = []
+    for name, field in Publication.model_fields.items():
+        if name in exclude:
+            continue
+        annotation = field.annotation
+        # Unwrap Optional[...]:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        if typing.get_origin(annotation) is typing.Union and len(args) == 1:
+            annotation = args[0]
+        if name in PARQUET_DICTIONARY_FIELDS:
+            arrow_type = pa.dictionary(pa.int32(), pa.string())
+        elif typing.get_origin(annotation) is list:
+            arrow_type = pa.list_(pa.string())
+        elif annotation is int:
+            arrow_type = pa.int64()
+        elif annotation is datetime.datetime:
+            arrow_type = pa.timestamp('us', tz='UTC')
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+# Sink for a Parquet dataset, partitioned by year (in Hive-style year=YYYY folders, so e.g. pyarrow.dataset and pandas pick
+# the year up from the path), with the list fields as list columns and the low-cardinality fields dictionary-encoded.
+# The records arrive in year order, so each year's file is written in turn, a row group at a time.
+# The dataset is built in a temporary folder that replaces the output when it's complete.
+# This needs pyarrow, which is only imported if the sink is used:
+class ParquetSink:
+    def __init__(self, output_dir, format_type='dppi', row_group_size=PARQUET_ROW_GROUP_SIZE):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.format_type = format_type
+        self.output_dir = output_dir
+        self.tmp_dir = f"{output_dir}.tmp"
+        self.row_group_size = row_group_size
+        self.schema = get_arrow_schema(pyarrow, exclude=['year'])
+        self.writers = {}
+        self.year = None
+        self.rows = []
+        if os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir)
+
+    def write(self, data):
+        if data['year'] != self.year or len(self.rows) >= self.row_group_size:
+            self._flush()
+            self.year = data['year']
+        self.rows.append(data)
+
+    def _flush(self):
+        if not self.rows:
+            return
+        columns = { name: [row[name] for row in self.rows] for name in self.schema.names }
+        # Dates were serialised as ISO strings:
+        columns['date'] = [datetime.datetime.fromisoformat(value) if value else None for value in columns['date']]
+        table = self.pa.Table.from_pydict(columns, schema=self.schema)
+        writer = self.writers.get(self.year)
+        if writer is None:
+            partition_dir = os.path.join(self.tmp_dir, f"year={self.year}")
+            os.makedirs(partition_dir, exist_ok=True)
+            writer = self.pq.ParquetWriter(os.path.join(partition_dir, 'part-0.parquet'), self.schema, compression='zstd')
+            self.writers[self.year] = writer
+        writer.write_table(table)
+        self.rows = []
+
+    def close(self):
+        self._flush()
+        for writer in self.writers.values():
+            writer.close()
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+        os.replace(self.tmp_dir, self.output_dir)
+
+# Writes each record to all the sinks, serialising it only once:
+class PublicationWriter:
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self.awindex = any(sink.format_type == 'awindex' for sink in sinks)
+        self.count = 0
+
+    def write(self, d: Publication):
+        data, index_data = serialise_publication(d, self.awindex)
+        for sink in self.sinks:
+            sink.write(index_data if sink.format_type == 'awindex' else data)
+        self.count += 1
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+# Set up the usual JSONL+CSV pair of sinks for an output prefix:
+def get_sinks(output_prefix, format_type='dppi'):
+    return [
+        JsonlSink(f"{output_prefix}.jsonl", format_type),
+        CsvSink(f"{output_prefix}.csv", format_type),
+    ]
+
+
+# Choose which reader to use for a given raw source file (or None if it should be skipped):
+def get_reader(input_file):
+    if input_file.endswith('.phaidra.jsonl'):
+        return normalise_phaidra_jsonl
+    elif input_file.endswith('.eventsair.json'):
+        #return normalise_eventsair_json
+        logger.info(f"Skipping {input_file} as this is handled elsewhere...")
+        return None
+    elif input_file.endswith('.zotero.jsonl'):
+        return normalise_zotero_jsonl
+    elif input_file.endswith('ideals.jsonl'):
+        return normalise_ideals_jsonl
+    elif input_file.endswith('ghent.csv'):
+        return normalise_ghent_csv
+    else:
+        logger.warning(f"No code to handle {input_file}!")
+        return None
+
+# Sort raw source files by year, then file name, so the merged output order is stable:
+def source_file_sort_key(input_file):
+    name = os.path.basename(input_file)
+    m = YEAR_RE.search(name)
+    year = int(m.group(1)) if m else sys.maxsize
+    return (year, name)
+
+# List the raw source files (or current snapshots, if the folder is a snapshot store) that have a reader, in merge order:
+def list_source_files(input_dir):
+    input_files = []
+    for path in list_sources(input_dir):
+        # Get the full input path:
+        input_file = os.path.join(input_dir, path)
+        if get_reader(input_file):
+            input_files.append(input_file)
+    return sorted(input_files, key=source_file_sort_key)
+
+# The run report stage for reading a source file:
+def source_stage(input_file):
+    return f"source:{os.path.basename(input_file)}"
+
+# Use the appropriate generator to parse the file into cleaned-up records:
+def iter_source_file(input_file):
+    logger.info(f"Reading {input_file}...")
+    input_reader = get_reader(input_file)
+    # Perform some common cleanup:
+    records = (common_cleanup(d) for d in input_reader(input_file))
+    yield from get_report().track(source_stage(input_file), records)
+    logger.info(f"Rule hits for {input_file}: {take_rule_hits()}")
+
+# Worker version of the above, returning a list so the results can be sent back from a worker process, along with the stage stats:
+def normalise_source_file(input_file):
+    records = list(iter_source_file(input_file))
+    return records, get_report().pop_stage(source_stage(input_file))
+
+# Normalise a list of source files, in a pool of worker processes if jobs > 1, returning the records for each file in order:
+def normalise_source_files(input_files, jobs=1):
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            # Time spent waiting for the workers is counted separately, as the source stages overlap:
+            results = get_report().track('workers', executor.map(normalise_source_file, input_files))
+            for input_file, (records, stats) in zip(input_files, results):
+                get_report().add(source_stage(input_file), **stats)
+                yield records
+    else:
+        for input_file in input_files:
+            records, stats = normalise_source_file(input_file)
+            get_report().add(source_stage(input_file), **stats)
+            yield records
+
+# Generate all the normalised records from a folder of raw source files.
+# With jobs > 1, each source file is normalised in a separate worker process, but the
+# results are still returned in the same order as a serial run.
+# With a cache_dir, the normalised records are cached as per-source shards, and only
+# the shards whose inputs (or the reader code) have changed get rebuilt.
+# With a deduplicator, duplicate records are merged.
+# With an author index, each record's creators are mapped to canonical author IDs.
+# Finally, each record is assigned its unique page path, recorded in the path_index:
+def generate_publications(input_dir, jobs=1, cache_dir=None, path_index=None, deduplicator=None, authors=None):
+    path_index = path_index or PubPathIndex()
+    report = get_report()
+    pubs = generate_normalised_publications(input_dir, jobs, cache_dir)
+    if deduplicator:
+        pubs = report.track('dedup', deduplicator.process(pubs))
+    for d in pubs:
+        if authors:
+            with report.timer('authors'):
+                authors.apply(d)
+        with report.timer('paths'):
+            path_index.assign(d)
+        yield d
+    for base_path, path in path_index.collisions:
+        logger.warning(f"Path collision for {base_path}, so using {path} instead.")
+
+def generate_normalised_publications(input_dir, jobs=1, cache_dir=None):
+    input_files = list_source_files(input_dir)
+    if cache_dir:
+        yield from generate_cached_publications(input_files, jobs, cache_dir)
+    elif jobs > 1:
+        for records in normalise_source_files(input_files, jobs):
+            yield from records
+    else:
+        for input_file in input_files:
+            yield from iter_source_file(input_file)
+
+# Some readers pull in other files, which need to be taken into account when checking for changes:
+def get_source_dependencies(input_file):
+    if input_file.endswith('.zotero.jsonl'):
+        return [
+            input_file,
+            input_file.replace(".zotero.jsonl", ".eventsair-osf-mapping.csv"),
+            input_file.replace(".zotero.jsonl", ".eventsair.json"),
+        ]
+    return [input_file]
+
+# The version of the reader/cleanup code, as a hash of the source code, so any code change invalidates the shards:
+def get_reader_version():
+    h = hashlib.sha256()
+    for module_path in READER_MODULES:
+        with open(module_path, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def load_shard_manifest(cache_dir):
+    manifest_path = os.path.join(cache_dir, SHARD_MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    return {'shards': {}}
+
+def save_shard_manifest(cache_dir, manifest):
+    manifest_path = os.path.join(cache_dir, SHARD_MANIFEST)
+    with open(f"{manifest_path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+# Write the normalised records for one source file out as a shard (atomically, so an interrupted run can't leave a partial shard):
+def write_shard(shard_path, records):
+    with open(f"{shard_path}.tmp", 'w') as f:
+        for d in records:
+            f.write(f'{d.model_dump_json()}\n')
+    os.replace(f"{shard_path}.tmp", shard_path)
+
+def read_shard(shard_path):
+    return read_publications_jsonl(shard_path)
+
+# Bring the cached shards up to date, then splice them together in merge order:
+def generate_cached_publications(input_files, jobs, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = load_shard_manifest(cache_dir)
+    reader_version = get_reader_version()
+
+    # Work out which shards need rebuilding:
+    entries = {}
+    stale = []
+    for input_file in input_files:
+        name = os.path.basename(input_file)
+        entry = {
+            'inputs': { os.path.basename(dep): source_hash(dep) for dep in get_source_dependencies(input_file) },
+            'reader_version': reader_version,
+            'shard': f"{name}.shard.jsonl",
+        }
+        old_entry = manifest['shards'].get(name)
+        if old_entry and old_entry['inputs'] == entry['inputs'] and old_entry['reader_version'] == reader_version \
+                and os.path.exists(os.path.join(cache_dir, entry['shard'])):
+            logger.info(f"Using cached shard for {input_file}...")
+            entry['count'] = old_entry['count']
+            get_report().record_cache('shards', 'hits')
+        else:
+            stale.append(input_file)
+            get_report().record_cache('shards', 'misses')
+        entries[name] = entry
+
+    # Re-normalise the stale ones:
+    for input_file, records in zip(stale, normalise_source_files(stale, jobs)):
+        entry = entries[os.path.basename(input_file)]
+        with get_report().timer('shards:write', len(records)):
+            write_shard(os.path.join(cache_dir, entry['shard']), records)
+        entry['count'] = len(records)
+
+    # Drop shards for source files that have gone away:
+    for name, old_entry in manifest['shards'].items():
+        if name not in entries:
+            logger.info(f"Removing shard for {name} as the source file has gone...")
+            shard_path = os.path.join(cache_dir, old_entry['shard'])
+            if os.path.exists(shard_path):
+                os.remove(shard_path)
+
+    manifest['shards'] = entries
+    save_shard_manifest(cache_dir, manifest)
+
+    # Splice the shards together:
+    for input_file in input_files:
+        yield from get_report().track('shards:read', read_shard(os.path.join(cache_dir, entries[os.path.basename(input_file)]['shard'])))
 
 
 # Main for CLI
@@ -423,45 +742,75 @@ if __name__ == "__main__":
         default='dppi',
         help="Specify the JSON format model type. Must be either 'awindex' for Awesome Indexes format or 'dppi' for the original format."
     )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=1,
+        help="Number of worker processes to use to normalise the raw source files in parallel (default: 1, i.e. serial)."
+    )
+    parser.add_argument(
+        '--cache-dir',
+        help="Folder in which to cache the normalised records for each source file, so only changed sources get re-normalised."
+    )
+
+    parser.add_argument(
+        '--dedup',
+        action='store_true',
+        help="Find duplicate records (across all sources, within each year), and merge the copies (of the same type, without different documents) into one, picking up their link fields."
+    )
+    parser.add_argument(
+        '--dedup-report',
+        help="Write the clusters of duplicates found, and any whole-proceedings volumes, to this JSON file. On its own, this only reports them, and keeps all the records."
+    )
+    parser.add_argument(
+        '--authors',
+        help="Author index JSON file, used to assign canonical author IDs to the creators. New names are added to it, and it is saved afterwards."
+    )
+    parser.add_argument(
+        '--path-index',
+        help="Write the index of assigned publication paths to this JSON file."
+    )
+    parser.add_argument(
+        '--awindex-prefix',
+        help="Also write the Awesome Indexes format to this output prefix, in the same pass."
+    )
+    parser.add_argument(
+        '--parquet',
+        help="Also write the records as a Parquet dataset (partitioned by year) to this folder, in the same pass. Needs pyarrow."
+    )
+
+    instrument.add_arguments(parser)
 
     parser.add_argument('output_prefix')
 
     args = parser.parse_args()
-    output_jsonl = args.output_prefix+".jsonl"
-    output_csv = args.output_prefix+".csv"
-
-    with open(output_jsonl, 'w') as outfile:
-        for path in os.listdir(args.input_dir):
-            # Get the full input path:
-            input_file = os.path.join(args.input_dir, path)
-            logger.info(f"Reading {input_file}...")
-
-            # Choose which reader to use:
-            if input_file.endswith('.phaidra.jsonl'):
-                input_reader = normalise_phaidra_jsonl
-            elif input_file.endswith('.eventsair.json'):
-                #input_reader = normalise_eventsair_json
-                logger.info(f"Skipping {input_file} as this is handled elsewhere...")
-                continue
-            elif input_file.endswith('.zotero.jsonl'):
-                input_reader = normalise_zotero_jsonl
-            elif input_file.endswith('ideals.jsonl'):
-                input_reader = normalise_ideals_jsonl
-            elif input_file.endswith('ghent.csv'):
-                input_reader = normalise_ghent_csv
-            else:
-                logger.warning(f"No code to handle {input_file}!")
-                continue
+    instrument.start(args, 'merger')
 
-            # Use the supplied generator to parse the file into records:
-            for d in input_reader(input_file):
-                # Perform some common cleanup:
-                d = common_cleanup(d)
-                # Write to file:
-                if args.format_type == 'awindex':
-                    outfile.write(f'{d.to_index_record().model_dump_json()}\n')
-                else:
-                    outfile.write(f'{d.model_dump_json()}\n')
+    # Set up the outputs:
+    sinks = get_sinks(args.output_prefix, args.format_type)
+    if args.awindex_prefix:
+        sinks += get_sinks(args.awindex_prefix, 'awindex')
+    if args.parquet:
+        sinks.append(ParquetSink(args.parquet))
+
+    # Write all the records out, in a single pass:
+    path_index = PubPathIndex()
+    deduplicator = Deduplicator(merge=args.dedup) if args.dedup or args.dedup_report else None
+    authors = AuthorIndex.load(args.authors) if args.authors else None
+    with PublicationWriter(sinks) as writer:
+        for d in generate_publications(args.input_dir, jobs=args.jobs, cache_dir=args.cache_dir, path_index=path_index, deduplicator=deduplicator, authors=authors):
+            with get_report().timer('write'):
+                writer.write(d)
+    logger.info(f"Wrote {writer.count} records.")
+
+    if authors:
+        authors.save(args.authors)
+        logger.info(f"Author index now has {len(authors.authors)} authors for {len(authors.variants)} name variants.")
+
+    if args.dedup_report:
+        with open(args.dedup_report, 'w') as f:
+            json.dump(deduplicator.report(), f, indent=2)
 
-    # Also write as CSV:
-    write_jsonl_to_csv(input_path=output_jsonl, output_path=output_csv)
\ No newline at end of file
+    if args.path_index:
+        with open(args.path_index, 'w') as f:
+            json.dump(path_index.paths, f, indent=2)
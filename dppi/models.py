@@ -10,6 +10,30 @@ def generate_pub_path(pub):
      path = f"ipres-{pub.year}/papers/{slug}"
      return path
 
+# Use the assigned path if there is one, otherwise generate it:
+def get_pub_path(pub):
+    return pub.path or generate_pub_path(pub)
+
+# Assigns each publication a unique path, once, for the whole corpus.
+# When two publications would get the same path, the later one (in merge order) gets a numeric suffix, so paths are stable between runs:
+class PubPathIndex:
+    def __init__(self):
+        self.paths = {}
+        self.collisions = []
+
+    def assign(self, pub):
+        base_path = generate_pub_path(pub)
+        path = base_path
+        n = 2
+        while path in self.paths:
+            path = f"{base_path}-{n}"
+            n += 1
+        if path != base_path:
+            self.collisions.append((base_path, path))
+        pub.path = path
+        self.paths[path] = pub.landing_page_url or pub.title
+        return pub
+
 # Pydantic data model for simple conference output records:
 class Publication(BaseModel):
     source_name: str
@@ -30,44 +54,65 @@ class Publication(BaseModel):
     type: str = 'paper'
     date: Optional[datetime] = None
     keywords: List[str] = []
+    path: Optional[str] = None # Unique path for this publication's page, assigned by PubPathIndex
+    creator_ids: List[str] = [] # Canonical author IDs for the creators, in the same order, assigned by AuthorIndex
 
     # Helper to generate the result in Awesome Indexes form:
     def to_index_record(self) -> IndexRecord:
-        # Construct:
-        ir = IndexRecord(
-            source=self.source_name,
-            source_url="https://www.digipres.org/publications/",
-            url=f"https://www.digipres.org/publications/ipres/{generate_pub_path(self)}/",
-            title=self.title,
-            creators=self.creators,
-            abstract=self.abstract,
-            date=self.date,
-            language="en",
-            type=self.type,
-            categories=None, 
-            license=self.license,
-            metadata={
-                'citation_conference_title': f'iPRES {self.year}',
-            },
-            links={}
-        )
-        # Optional data:
-        if self.keywords and len(self.keywords) > 0:
-            ir.keywords = self.keywords
-        if self.institutions and len(self.institutions) > 0:
-            ir.metadata['institutions'] = json.dumps(self.institutions)
-        # Links
-        if self.landing_page_url:
-            ir.links['citation_public_url'] = self.landing_page_url
-        if self.document_url:
-            ir.links['citation_pdf_url'] = self.document_url
-        if self.slides_url:
-            ir.links['citation_conference_slides_url'] = self.slides_url
-        if self.notes_url:
-            ir.links['citation_conference_notes_url'] = self.notes_url
-        if self.stream_url:
-            ir.links['citation_conference_recording_url'] = self.stream_url
-        if self.submission_url:
-            ir.links['citation_conference_submission_url'] = self.submission_url
+        return IndexRecord.model_validate(index_record_values(self, self.model_dump(mode='json')))
+
+# Which of our link fields map to which Awesome Indexes links:
+INDEX_RECORD_LINKS = {
+    'landing_page_url': 'citation_public_url',
+    'document_url': 'citation_pdf_url',
+    'slides_url': 'citation_conference_slides_url',
+    'notes_url': 'citation_conference_notes_url',
+    'stream_url': 'citation_conference_recording_url',
+    'submission_url': 'citation_conference_submission_url',
+}
+
+# The values for the Awesome Indexes form of a publication, taken from its already-serialised form,
+# so both forms can be produced from a single serialisation:
+def index_record_values(pub, data):
+    metadata = {
+        'citation_conference_title': f"iPRES {data['year']}",
+    }
+    # Optional data:
+    if data['institutions']:
+        metadata['institutions'] = json.dumps(data['institutions'])
+    values = {
+        'source': data['source_name'],
+        'source_url': "https://www.digipres.org/publications/",
+        'url': f"https://www.digipres.org/publications/ipres/{get_pub_path(pub)}/",
+        'title': data['title'],
+        'creators': data['creators'],
+        'abstract': data['abstract'],
+        'date': data['date'],
+        'language': "en",
+        'type': data['type'],
+        'categories': None,
+        'license': data['license'],
+        'metadata': metadata,
+        'links': { link: data[field] for field, link in INDEX_RECORD_LINKS.items() if data[field] },
+    }
+    if data['keywords']:
+        values['keywords'] = data['keywords']
+    return values
+
+# Generate the Awesome Indexes form of a publication as plain (JSON-compatible) data.
+# This still goes through IndexRecord, so the output is checked, and follows whatever version of awindex is installed:
+def index_record_data(pub, data):
+    return IndexRecord.model_validate(index_record_values(pub, data)).model_dump(mode='json')
+
+# Serialise a publication to plain (JSON-compatible) data, returning the dppi form and (if wanted) the Awesome Indexes form:
+def serialise_publication(pub: Publication, awindex=True):
+    data = pub.model_dump(mode='json')
+    return data, index_record_data(pub, data) if awindex else None
 
-        return ir
\ No newline at end of file
+# Read the records from a JSONL file.
+# Note that pydantic-core's JSON validation is already about as fast as json.loads, so this validates each line directly:
+# validating batches via a TypeAdapter over a list, or skipping validation via model_construct, were both measured to be slower.
+def read_publications_jsonl(input_path):
+    with open(input_path) as f:
+        for line in f:
+            yield Publication.model_validate_json(line)
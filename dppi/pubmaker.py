@@ -1,34 +1,89 @@
-import urllib.request
 import argparse
-import json
+import glob
+import logging
 import os.path
-from dppi.models import Publication, generate_pub_path
+from concurrent.futures import ProcessPoolExecutor
+from dppi.models import Publication, get_pub_path
+from dppi import instrument
+from dppi.instrument import get_report
 import frontmatter
 
+logger = logging.getLogger(__name__)
+
+# Render a publication to its Markdown+frontmatter page, returning the relative path and the content:
+def render_publication(pub: Publication):
+    year = pub.year
+    # Convert to dict
+    metadata = dict(pub)
+    # The path is where the page goes, and would clash with the page.path Jekyll sets:
+    metadata.pop('path')
+    # The author IDs are internal to the index:
+    metadata.pop('creator_ids')
+    metadata['publication_type'] = metadata.pop('type')
+    metadata['layout'] = 'publication'
+    metadata['parent'] = f'iPRES {year}'
+    metadata['grand_parent'] = 'iPRES'
+    metadata['year'] = year
+    post = frontmatter.Post("", **metadata)
+    return f"{get_pub_path(pub)}.md", frontmatter.dumps(post).encode('utf-8')
+
+# Only write the page if the content has changed, so unchanged pages keep their mtime.
+# Writes are atomic, so a partially written page is never seen:
+def write_if_changed(output_file, content):
+    if os.path.exists(output_file):
+        with open(output_file, 'rb') as f:
+            if f.read() == content:
+                return False
+    else:
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(f"{output_file}.tmp", 'wb') as f:
+        f.write(content)
+    os.replace(f"{output_file}.tmp", output_file)
+    return True
+
+# Worker: parse, render and (if needed) write the page for one JSONL line:
+def make_page(line, output_dir):
+    pub = Publication.model_validate_json(line)
+    path, content = render_publication(pub)
+    output_file = os.path.normpath(os.path.join(output_dir, path))
+    return output_file, write_if_changed(output_file, content)
+
+# Generate all the pages, spread over `jobs` worker processes, and remove any pages that are no longer needed:
+def make_pages(input_jsonl, output_dir, jobs=1):
+    report = get_report()
+    with open(input_jsonl) as in_file:
+        lines = in_file.readlines()
+    output_dirs = [output_dir] * len(lines)
+    with report.timer('render', len(lines)):
+        if jobs > 1:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(make_page, lines, output_dirs, chunksize=64))
+        else:
+            results = list(map(make_page, lines, output_dirs))
+
+    expected = set(output_file for output_file, _ in results)
+    written = sum(1 for _, changed in results if changed)
+    deleted = 0
+    with report.timer('cleanup', 0):
+        for existing in glob.glob(os.path.join(output_dir, 'ipres-*', 'papers', '*.md')):
+            if os.path.normpath(existing) not in expected:
+                os.remove(existing)
+                deleted += 1
+    logger.info(f"Wrote {written} pages, left {len(results) - written} unchanged, and deleted {deleted}.")
+
+
 # Main for CLI
 if __name__ == "__main__":
     # Set up a simpler argument parser:
     parser = argparse.ArgumentParser()
     parser.add_argument('input_jsonl')
     parser.add_argument('output_dir')
+    parser.add_argument('--jobs', type=int, default=1, help="Number of worker processes to render the pages with.")
+
+    instrument.add_arguments(parser)
 
     args = parser.parse_args()
+    instrument.start(args, 'pubmaker')
 
-    # Open the source JSONL, convert to a suitably-named Markdown+frontmatter file:
-    with open(args.input_jsonl) as in_file:
-        for line in in_file:
-            pub = Publication.model_validate_json(line)
-            year = pub.year
-            output_file = os.path.join(args.output_dir, f"./{generate_pub_path(pub)}.md" )
-            if not os.path.exists(os.path.dirname(output_file)):
-                    os.makedirs(os.path.dirname(output_file))
-            # Convert to dict
-            metadata = dict(pub)
-            metadata['publication_type'] = metadata.pop('type')
-            metadata['layout'] = 'publication'
-            metadata['parent'] = f'iPRES {year}'
-            metadata['grand_parent'] = 'iPRES'
-            metadata['year'] = year
-            with open(output_file, 'wb') as f:
-                 post = frontmatter.Post("", **metadata)
-                 frontmatter.dump(post, f)
\ No newline at end of file
+    # Open the source JSONL, convert to suitably-named Markdown+frontmatter files:
+    make_pages(args.input_jsonl, args.output_dir, jobs=args.jobs)
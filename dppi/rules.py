@@ -0,0 +1,133 @@
+import re
+
+# Declarative rules for classifying records and cleaning up fields.
+#
+# Each rule is a dict with:
+#   name: used for the hit counters
+#   field: the field the rule looks at
+#   one of:
+#     equals/prefix/contains: a string (or list of strings) to look for
+#     regex: a pattern, matched at the start of the field (so use .* to look anywhere), except for 'remove' rules, which search
+#   ignore_case: optional, match regardless of case
+# and then one of these actions:
+#   set: a dict of field values to set when the rule matches (only the first matching 'set' rule for each field fires)
+#   remove: remove every match of the rule from the field (these rules all fire, in order)
+#   set_from_group: with remove, a dict of fields to set (lower-cased) from groups of the pattern
+# Rules with no action are just classified, i.e. RuleSet.match() tells the caller which rule matched.
+
+# Turn a rule's condition into a regex pattern:
+def rule_pattern(rule):
+    if 'regex' in rule:
+        pattern = rule['regex']
+    else:
+        for kind in ['equals', 'prefix', 'contains']:
+            if kind in rule:
+                break
+        values = rule[kind] if isinstance(rule[kind], list) else [rule[kind]]
+        pattern = "|".join(re.escape(value) for value in values)
+        if kind == 'equals':
+            pattern = f"(?:{pattern})\\Z"
+        elif kind == 'contains' and not rule.get('remove'):
+            pattern = f"(?s:.*?)(?:{pattern})"
+    if rule.get('ignore_case'):
+        pattern = f"(?i:{pattern})"
+    return pattern
+
+# A table of rules, compiled once. The matching rules for each field are combined into a single regex with one named group per rule,
+# so each field is scanned in one go, and as alternatives are tried in order, the first rule in the table that matches wins:
+class RuleSet:
+    def __init__(self, rules):
+        self.rules = rules
+        self.hits = { rule['name']: 0 for rule in rules }
+        self.matchers = {}
+        self.rewrites = {}
+        for rule in rules:
+            self.matchers.setdefault(rule['field'], [])
+            self.rewrites.setdefault(rule['field'], [])
+            if rule.get('remove'):
+                self.rewrites[rule['field']].append((rule, re.compile(rule_pattern(rule))))
+            else:
+                self.matchers[rule['field']].append(rule)
+        for field, field_rules in self.matchers.items():
+            combined = "|".join(f"(?P<r{i}>{rule_pattern(rule)})" for i, rule in enumerate(field_rules))
+            self.matchers[field] = (re.compile(combined), field_rules) if field_rules else None
+
+    # Find the first rule in the table that matches the value of a field (or None):
+    def match(self, field, value):
+        matcher = self.matchers.get(field)
+        if not matcher or value is None:
+            return None
+        combined, field_rules = matcher
+        m = combined.match(value)
+        if not m:
+            return None
+        rule = field_rules[int(m.lastgroup[1:])]
+        self.hits[rule['name']] += 1
+        return rule
+
+    # Apply the rules to a record, field by field:
+    def apply(self, record):
+        for field in self.matchers:
+            rule = self.match(field, getattr(record, field))
+            if rule and 'set' in rule:
+                for key, value in rule['set'].items():
+                    setattr(record, key, value)
+            for rule, pattern in self.rewrites[field]:
+                value = getattr(record, field)
+                m = pattern.search(value) if value is not None else None
+                if not m:
+                    continue
+                self.hits[rule['name']] += 1
+                for key, group in rule.get('set_from_group', {}).items():
+                    setattr(record, key, m.group(group).lower())
+                setattr(record, field, pattern.sub("", value))
+        return record
+
+    # Return the hit counts, and reset them:
+    def take_hits(self):
+        hits = { name: count for name, count in self.hits.items() if count }
+        self.hits = dict.fromkeys(self.hits, 0)
+        return hits
+
+# PHAIDRA (iPRES 2004-2019) records:
+PHAIDRA_RULES = RuleSet([
+    # Drop invalid/empty abstracts:
+    { 'name': 'phaidra-empty-abstract', 'field': 'abstract', 'equals': 'x', 'set': { 'abstract': None } },
+    # Catch how Lightning Talks are indicated:
+    { 'name': 'phaidra-lightning-talk', 'field': 'abstract', 'equals': 'Lightning Talk', 'set': { 'type': 'lightning talk', 'abstract': None } },
+    # Distinguish posters based on title or phrase in abstract:
+    { 'name': 'phaidra-poster-abstract', 'field': 'abstract', 'contains': ['this poster', 'the poster', 'our poster'], 'ignore_case': True, 'set': { 'type': 'poster' } },
+    { 'name': 'phaidra-poster-title', 'field': 'title', 'contains': [': Poster ', ' (Poster) '], 'set': { 'type': 'poster' } },
+    # Clean up titles, using any useful metadata in the title:
+    { 'name': 'phaidra-title-type-suffix', 'field': 'title', 'regex': r"(:|-) ([a-zA-Z ]+) (:|-) (iPres|iPRES) \d{4} (:|-) [a-zA-Z, ]+$", 'remove': True, 'set_from_group': { 'type': 2 } },
+    { 'name': 'phaidra-title-suffix', 'field': 'title', 'regex': r"(:|-) (iPres|iPRES|iPES) \d{4} (: |- |– |)[a-zA-Z, ]+$", 'remove': True },
+])
+
+# EventsAir (iPRES 2022) agenda items, where the type is indicated by a title prefix:
+EVENTSAIR_RULES = RuleSet([
+    { 'name': f"eventsair-{type.lower().replace(' ', '-')}", 'field': 'title', 'prefix': f"{type}: ", 'set': { 'type': type.lower() } }
+    for type in ["Panel", "Tutorial", "Workshop", "Long Paper", "Short Paper", "Poster"]
+] + [
+    # Some strings to strip from title:
+    { 'name': 'eventsair-title-prefix', 'field': 'title', 'contains': ['Short Paper: ', 'Long Paper: ', 'Workshop: ', 'Panel: ', 'Poster: ', 'Tutorial: ', 'TUTORIAL: '], 'remove': True },
+])
+
+# OSF (iPRES 2022) file names, and which link field each kind of file is used for ('link': None means the file is skipped):
+OSF_FILE_RULES = RuleSet([
+    { 'name': 'osf-ignored', 'field': 'name', 'prefix': ['iPres22_Biography_', 'iPres22_Holding-Slide'], 'link': None },
+    { 'name': 'osf-unused', 'field': 'name', 'prefix': ['iPres22_Abstract_', 'iPres22_Posters_', 'iPres22_Video-Transcript_', 'iPres22_Memo_'], 'link': None, 'unused': True },
+    { 'name': 'osf-unused-transcript', 'field': 'name', 'regex': r".*?iPres22_.. Transcript_", 'link': None, 'unused': True },
+    { 'name': 'osf-slides', 'field': 'name', 'prefix': ['iPres22_Slides_', 'iPres22_LightningTalk_', 'iPres22_Poster_'], 'link': 'slides_url' },
+    { 'name': 'osf-notes', 'field': 'name', 'prefix': 'iPres22_Collaborative-Notes', 'link': 'notes_url' },
+    { 'name': 'osf-document', 'field': 'name', 'prefix': ['iPres22_Long-Paper_', 'iPres22_Short-Paper_', 'iPres22_Panel_', 'iPres22_Tutorial_', 'iPres22_Workshop_', 'iPres22_Poster-Proposal_'], 'link': 'document_url' },
+    { 'name': 'osf-stream', 'field': 'name', 'prefix': ['iPres22_Recording_', 'iPres22_Poster-Video_'], 'link': 'stream_url' },
+])
+
+RULE_SETS = [PHAIDRA_RULES, EVENTSAIR_RULES, OSF_FILE_RULES]
+
+# Collect (and reset) the hit counts from all the rule sets:
+def take_rule_hits():
+    hits = {}
+    for rule_set in RULE_SETS:
+        hits.update(rule_set.take_hits())
+    return hits
@@ -0,0 +1,396 @@
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import time
+import heapq
+import struct
+import logging
+import argparse
+import threading
+import urllib.parse
+from array import array
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from .models import read_publications_jsonl
+from .authors import AuthorIndex, get_creator_names
+from .dedup import strip_accents
+
+logger = logging.getLogger(__name__)
+
+# The index file starts with this, followed by the length of the JSON header, the header, and then the sections:
+MAGIC = b'DPPIIDX1'
+# Sections start on 8-byte boundaries, so they can be cast to typed arrays in place:
+ALIGNMENT = 8
+# Fields to search, and how much a match in each one counts for (e.g. a word in the title counts three times as much as in the abstract):
+FIELD_WEIGHTS = { 'title': 3.0, 'keywords': 2.0, 'creators': 2.0, 'abstract': 1.0 }
+# Fields to facet on:
+FACET_FIELDS = ['year', 'type']
+# Fields returned with each result:
+RESULT_FIELDS = ['title', 'year', 'type', 'creators', 'path', 'landing_page_url', 'document_url']
+# BM25 parameters:
+BM25_K1 = 1.2
+BM25_B = 0.75
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+DEFAULT_PORT = 8002
+# How often the server checks whether the index file has been replaced, in seconds:
+DEFAULT_POLL_INTERVAL = 5
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Lower case, no accents, split on anything that's not a letter or digit:
+def tokenize(text):
+    return TOKEN_RE.findall(strip_accents(text).lower())
+
+def get_field_text(pub, field, authors=None):
+    if field == 'creators':
+        return " ".join(get_creator_names(pub, authors))
+    value = getattr(pub, field)
+    if isinstance(value, list):
+        return " ".join(value)
+    return value or ""
+
+# Build the index from a stream of publications, and write it to a file.
+#
+# The ranking is BM25F-style, i.e. each document's term frequencies and length are the weighted sums over the fields.
+# As the corpus is fixed once built, the BM25 score of each term in each document is worked out here and stored in the
+# postings (as its 'impact'), so a query just adds up the impacts of its terms.
+#
+# The file is written to a temporary file and moved into place, so a running server never sees a partial index:
+def build_index(pubs, output_path, authors=None):
+    postings = {}
+    doc_lengths = []
+    docs = []
+    facets = { field: {} for field in FACET_FIELDS }
+    doc_facets = { field: array('H') for field in FACET_FIELDS }
+    for doc_id, pub in enumerate(pubs):
+        tfs = {}
+        length = 0.0
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(get_field_text(pub, field, authors)):
+                tfs[token] = tfs.get(token, 0.0) + weight
+                length += weight
+        for token, tf in tfs.items():
+            postings.setdefault(token, []).append((doc_id, tf))
+        doc_lengths.append(length)
+        for field in FACET_FIELDS:
+            value = str(getattr(pub, field))
+            doc_facets[field].append(facets[field].setdefault(value, len(facets[field])))
+        result = { field: getattr(pub, field) for field in RESULT_FIELDS }
+        result['creators'] = get_creator_names(pub, authors)
+        docs.append(json.dumps(result, ensure_ascii=False).encode('utf-8'))
+
+    doc_count = len(docs)
+    avg_length = sum(doc_lengths) / doc_count if doc_count else 0.0
+    terms = sorted(postings)
+    term_offsets = array('I', [0])
+    term_bytes = bytearray()
+    posting_offsets = array('I', [0])
+    posting_docs = array('I')
+    posting_impacts = array('f')
+    for term in terms:
+        term_bytes += term.encode('utf-8')
+        term_offsets.append(len(term_bytes))
+        term_postings = postings[term]
+        idf = math.log(1 + (doc_count - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+        for doc_id, tf in term_postings:
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths[doc_id] / avg_length)
+            posting_docs.append(doc_id)
+            posting_impacts.append(idf * tf * (BM25_K1 + 1) / (tf + norm))
+        posting_offsets.append(len(posting_docs))
+
+    doc_offsets = array('I', [0])
+    doc_bytes = bytearray()
+    for doc in docs:
+        doc_bytes += doc
+        doc_offsets.append(len(doc_bytes))
+
+    sections = {
+        'term_offsets': term_offsets,
+        'term_bytes': bytes(term_bytes),
+        'posting_offsets': posting_offsets,
+        'posting_docs': posting_docs,
+        'posting_impacts': posting_impacts,
+        'doc_offsets': doc_offsets,
+        'doc_bytes': bytes(doc_bytes),
+    }
+    # For each facet, a bitset of the documents with each value, plus the value of each document (for counting):
+    bitset_size = (doc_count + 7) // 8
+    for field in FACET_FIELDS:
+        bitsets = bytearray(bitset_size * len(facets[field]))
+        for doc_id, value_id in enumerate(doc_facets[field]):
+            bitsets[value_id * bitset_size + (doc_id >> 3)] |= 1 << (doc_id & 7)
+        sections[f"bitsets_{field}"] = bytes(bitsets)
+        sections[f"values_{field}"] = doc_facets[field]
+
+    write_index_file(output_path, {
+        'built': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'doc_count': doc_count,
+        'term_count': len(terms),
+        'byteorder': sys.byteorder,
+        'facets': { field: list(values) for field, values in facets.items() },
+    }, sections)
+    return doc_count, len(terms)
+
+def write_index_file(output_path, header, sections):
+    # Work out where each section goes, which needs the header size, which depends on the offsets, so allow enough room for those:
+    layout = {}
+    for name, data in sections.items():
+        typecode = data.typecode if isinstance(data, array) else 'B'
+        layout[name] = [0, typecode, len(data) * (data.itemsize if isinstance(data, array) else 1)]
+    header['sections'] = layout
+    header_room = len(json.dumps(header)) + 20 * len(layout) + ALIGNMENT
+    offset = align(len(MAGIC) + 4 + header_room)
+    for name in sections:
+        layout[name][0] = offset
+        offset = align(offset + layout[name][2])
+    header_bytes = json.dumps(header).encode('utf-8').ljust(header_room)
+    with open(f"{output_path}.tmp", 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header_bytes)))
+        f.write(header_bytes)
+        for name, data in sections.items():
+            f.write(b'\0' * (layout[name][0] - f.tell()))
+            f.write(data.tobytes() if isinstance(data, array) else data)
+    os.replace(f"{output_path}.tmp", output_path)
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+# A built index, memory-mapped, with each section accessed in place as a typed array:
+class SearchIndex:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise Exception(f"{path} is not a search index!")
+        header_length, = struct.unpack_from('<I', self.mm, len(MAGIC))
+        start = len(MAGIC) + 4
+        self.header = json.loads(self.mm[start:start + header_length])
+        if self.header['byteorder'] != sys.byteorder:
+            raise Exception(f"{path} was built on a machine with a different byte order!")
+        view = memoryview(self.mm)
+        self.sections = {}
+        # All the views onto the file (each after the view it was made from), as they have to be released before it can be closed:
+        self.views = [view]
+        for name, (offset, typecode, size) in self.header['sections'].items():
+            section = view[offset:offset + size]
+            self.sections[name] = section.cast(typecode) if typecode != 'B' else section
+            self.views += [section, self.sections[name]]
+        # Number of requests using this index (see SearchService.use):
+        self.users = 0
+        self.doc_count = self.header['doc_count']
+        self.bitset_size = (self.doc_count + 7) // 8
+        self.facet_ids = { field: { value: i for i, value in enumerate(values) } for field, values in self.header['facets'].items() }
+
+    def close(self):
+        for view in reversed(self.views):
+            view.release()
+        self.sections = {}
+        self.mm.close()
+
+    # Binary search of the sorted term dictionary, returning the term number or None:
+    def find_term(self, term):
+        term = term.encode('utf-8')
+        offsets = self.sections['term_offsets']
+        term_bytes = self.sections['term_bytes']
+        lo, hi = 0, len(offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            candidate = term_bytes[offsets[mid]:offsets[mid + 1]].tobytes()
+            if candidate < term:
+                lo = mid + 1
+            elif candidate > term:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    # The documents matching the facet filters (any of the values for a facet, and all the facets), as a bitset, or None for all of them:
+    def filter_bitset(self, filters):
+        combined = None
+        for field, values in filters.items():
+            bitsets = self.sections[f"bitsets_{field}"]
+            field_bits = 0
+            for value in values:
+                value_id = self.facet_ids[field].get(value)
+                if value_id is not None:
+                    field_bits |= int.from_bytes(bitsets[value_id * self.bitset_size:(value_id + 1) * self.bitset_size], 'little')
+            combined = field_bits if combined is None else combined & field_bits
+        return combined.to_bytes(self.bitset_size, 'little') if combined is not None else None
+
+    def get_doc(self, doc_id):
+        offsets = self.sections['doc_offsets']
+        return json.loads(self.sections['doc_bytes'][offsets[doc_id]:offsets[doc_id + 1]].tobytes())
+
+    # Run a query, with optional facet filters (e.g. { 'year': ['2022'] }), returning the top results and the facet counts.
+    # With no query text, all the documents that pass the filters are returned, in index order:
+    def search(self, query, filters=None, limit=DEFAULT_LIMIT, offset=0):
+        start = time.perf_counter()
+        bits = self.filter_bitset(filters or {})
+        if query and query.strip():
+            scores = {}
+            posting_offsets = self.sections['posting_offsets']
+            posting_docs = self.sections['posting_docs']
+            posting_impacts = self.sections['posting_impacts']
+            for term in set(tokenize(query)):
+                term_id = self.find_term(term)
+                if term_id is None:
+                    continue
+                a, b = posting_offsets[term_id], posting_offsets[term_id + 1]
+                for doc_id, impact in zip(posting_docs[a:b], posting_impacts[a:b]):
+                    scores[doc_id] = scores.get(doc_id, 0.0) + impact
+            if bits is not None:
+                scores = { doc_id: score for doc_id, score in scores.items() if bits[doc_id >> 3] & (1 << (doc_id & 7)) }
+            matches = list(scores)
+            ranked = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))[offset:]
+        else:
+            matches = [doc_id for doc_id in range(self.doc_count) if bits is None or bits[doc_id >> 3] & (1 << (doc_id & 7))]
+            ranked = [(doc_id, None) for doc_id in matches[offset:offset + limit]]
+        facets = {}
+        for field in FACET_FIELDS:
+            values = self.header['facets'][field]
+            doc_values = self.sections[f"values_{field}"]
+            counts = {}
+            for doc_id in matches:
+                value = values[doc_values[doc_id]]
+                counts[value] = counts.get(value, 0) + 1
+            facets[field] = dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+        return {
+            'total': len(matches),
+            'results': [{ **self.get_doc(doc_id), 'score': score } for doc_id, score in ranked],
+            'facets': facets,
+            'took_ms': (time.perf_counter() - start) * 1000,
+        }
+
+# Holds the current index, and swaps in a new one when the index file is replaced.
+# Requests pick up the current index once, so the ones in progress during a swap finish with the old one,
+# which is closed (unmapping the old file) once the last of them is done:
+class SearchService:
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.lock = threading.Lock()
+        self.index = SearchIndex(index_path)
+        logger.info(f"Loaded {index_path}, built {self.index.header['built']}, with {self.index.doc_count} documents.")
+
+    def reload_if_changed(self):
+        try:
+            stat = os.stat(self.index_path)
+            if (stat.st_ino, stat.st_mtime_ns) == (self.index.stat.st_ino, self.index.stat.st_mtime_ns):
+                return False
+            index = SearchIndex(self.index_path)
+        except Exception as e:
+            logger.error(f"Could not load the new index, so keeping the current one: {e}")
+            return False
+        with self.lock:
+            old_index, self.index = self.index, index
+            if old_index.users == 0:
+                old_index.close()
+        logger.info(f"Swapped in the new index, built {index.header['built']}, with {index.doc_count} documents.")
+        return True
+
+    @contextmanager
+    def use(self):
+        with self.lock:
+            index = self.index
+            index.users += 1
+        try:
+            yield index
+        finally:
+            with self.lock:
+                index.users -= 1
+                if index is not self.index and index.users == 0:
+                    index.close()
+
+    def watch(self, interval=DEFAULT_POLL_INTERVAL):
+        def poll():
+            while True:
+                time.sleep(interval)
+                self.reload_if_changed()
+        threading.Thread(target=poll, daemon=True).start()
+
+# JSON API:
+#   /search?q=...&year=...&type=...&limit=...&offset=...  (year and type can be repeated to match any of them)
+#   /health
+class SearchHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        if url.path == '/search':
+            try:
+                # (a limit of 0 just gets the total and the facet counts)
+                limit = max(min(int(params.get('limit', [DEFAULT_LIMIT])[0]), MAX_LIMIT), 0)
+                offset = max(int(params.get('offset', [0])[0]), 0)
+            except ValueError:
+                return self.send_json(400, { 'error': "limit and offset must be integers" })
+            filters = { field: params[field] for field in FACET_FIELDS if field in params }
+            with self.server.service.use() as index:
+                results = index.search(params.get('q', [''])[0], filters, limit, offset)
+            self.send_json(200, results)
+        elif url.path == '/health':
+            with self.server.service.use() as index:
+                health = { 'built': index.header['built'], 'doc_count': index.doc_count, 'term_count': index.header['term_count'] }
+            self.send_json(200, health)
+        else:
+            self.send_json(404, { 'error': f"No such endpoint {url.path}" })
+
+    def send_json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        # So the search widget can call this from other sites:
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+def serve(index_path, host='127.0.0.1', port=DEFAULT_PORT, poll_interval=DEFAULT_POLL_INTERVAL):
+    server = ThreadingHTTPServer((host, port), SearchHandler)
+    server.daemon_threads = True
+    server.service = SearchService(index_path)
+    server.service.watch(poll_interval)
+    logger.info(f"Serving search on http://{host}:{port}/search")
+    server.serve_forever()
+
+
+# Main for CLI
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # Set up a simpler argument parser:
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    build_parser = subparsers.add_parser('build', help="Build the index file from the merged JSONL.")
+    build_parser.add_argument('input_jsonl')
+    build_parser.add_argument('index_path')
+    build_parser.add_argument('--authors', help="Author index JSON file (as written by the merger), so creators are indexed under their canonical names.")
+    serve_parser = subparsers.add_parser('serve', help="Serve the JSON search API, swapping in the index whenever the file is rebuilt.")
+    serve_parser.add_argument('index_path')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL, help="How often to check for a new index file, in seconds.")
+    query_parser = subparsers.add_parser('query', help="Run a query against the index file, and print the results.")
+    query_parser.add_argument('index_path')
+    query_parser.add_argument('query')
+    for field in FACET_FIELDS:
+        query_parser.add_argument(f"--{field}", action='append', help=f"Only return results with this {field} (can be repeated).")
+    query_parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+
+    args = parser.parse_args()
+
+    if args.action == 'build':
+        authors = AuthorIndex.load(args.authors) if args.authors else None
+        doc_count, term_count = build_index(read_publications_jsonl(args.input_jsonl), args.index_path, authors)
+        logger.info(f"Indexed {doc_count} documents, with {term_count} distinct terms.")
+    elif args.action == 'serve':
+        serve(args.index_path, args.host, args.port, args.poll_interval)
+    elif args.action == 'query':
+        filters = { field: getattr(args, field) for field in FACET_FIELDS if getattr(args, field) }
+        print(json.dumps(SearchIndex(args.index_path).search(args.query, filters, args.limit), indent=2, ensure_ascii=False))
@@ -0,0 +1,183 @@
+import io
+import os
+import sys
+import json
+import time
+import fcntl
+import hashlib
+import logging
+import argparse
+import functools
+from contextlib import contextmanager
+import zstandard
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+# Held while the manifest is being updated, as fetchers can run at the same time (e.g. with make -j):
+LOCK_FILE = '.lock'
+# The snapshots are written once and read many times, so it's worth compressing them hard (this doesn't slow down reading):
+COMPRESSION_LEVEL = 19
+CHUNK_SIZE = 1024*1024
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# Content-addressed store of zstd-compressed raw source snapshots.
+# Each snapshot is stored under the SHA-256 hash of its uncompressed content, so refetching an unchanged source costs nothing,
+# and the manifest records the current snapshot for each source name, along with the history of previous ones.
+class SnapshotStore:
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.manifest = self.load()
+
+    def load(self):
+        manifest_path = os.path.join(self.store_dir, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                return json.load(f)
+        return { 'current': {}, 'history': {} }
+
+    # Update the manifest: under the lock, pick up any changes other processes have saved, then save it with ours.
+    # It's only rewritten if something has changed (so an unchanged fetch doesn't trigger a rebuild):
+    @contextmanager
+    def update(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        manifest_path = os.path.join(self.store_dir, MANIFEST)
+        with open(os.path.join(self.store_dir, LOCK_FILE), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.manifest = self.load()
+            before = json.dumps(self.manifest, sort_keys=True)
+            yield self.manifest
+            if os.path.exists(manifest_path) and json.dumps(self.manifest, sort_keys=True) == before:
+                return
+            with open(f"{manifest_path}.tmp", 'w') as f:
+                json.dump(self.manifest, f, indent=2, sort_keys=True)
+            os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    def save(self):
+        with self.update():
+            pass
+
+    def object_path(self, sha256):
+        return os.path.join(self.store_dir, 'objects', sha256[:2], f"{sha256}.zst")
+
+    def names(self):
+        return sorted(self.manifest['current'])
+
+    # The hash of the current snapshot of a source (or None):
+    def current(self, name):
+        return self.manifest['current'].get(name)
+
+    # Make a file the current snapshot of a source, compressing it into the store unless an identical snapshot is already there:
+    def add_file(self, name, path):
+        sha256 = hash_file(path)
+        object_path = self.object_path(sha256)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            cctx = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL)
+            # (the temporary file is per-process, in case another fetch is storing the same content)
+            tmp_path = f"{object_path}.{os.getpid()}.tmp"
+            with open(path, 'rb') as in_file, open(tmp_path, 'wb') as out_file:
+                cctx.copy_stream(in_file, out_file, read_size=CHUNK_SIZE)
+            os.replace(tmp_path, object_path)
+        with self.update() as manifest:
+            if manifest['current'].get(name) == sha256:
+                logger.info(f"Snapshot of {name} is unchanged.")
+                return sha256
+            manifest['current'][name] = sha256
+            manifest['history'].setdefault(name, []).append({
+                'sha256': sha256,
+                'size': os.path.getsize(path),
+                'compressed_size': os.path.getsize(object_path),
+                'added': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            })
+        logger.info(f"Stored new snapshot of {name} as {sha256}.")
+        return sha256
+
+    # Open a snapshot (the current one by default) as a text stream, decompressing it as it's read:
+    def open(self, name, sha256=None, encoding='utf-8', newline=None):
+        sha256 = sha256 or self.current(name)
+        if sha256 is None:
+            raise FileNotFoundError(f"No snapshot of {name} in {self.store_dir}!")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(self.object_path(sha256), 'rb'), read_size=CHUNK_SIZE, closefd=True)
+        return io.TextIOWrapper(reader, encoding=encoding, newline=newline)
+
+def is_snapshot_store(folder):
+    return os.path.exists(os.path.join(folder, MANIFEST))
+
+# Shared instances, so the manifest is only read once per process:
+@functools.lru_cache(maxsize=None)
+def get_store(store_dir):
+    return SnapshotStore(store_dir)
+
+# The raw source files in a folder, which may be a snapshot store:
+def list_sources(folder):
+    if is_snapshot_store(folder):
+        return get_store(folder).names()
+    return os.listdir(folder)
+
+# Open a raw source file for reading. Paths in a snapshot store are read from the current snapshot of that name:
+def open_source(path, encoding='utf-8', newline=None):
+    store_dir, name = os.path.split(path)
+    if is_snapshot_store(store_dir):
+        return get_store(store_dir).open(name, encoding=encoding, newline=newline)
+    return open(path, encoding=encoding, newline=newline)
+
+# The hash of a raw source file's content, which for a snapshot comes straight from the manifest:
+def source_hash(path):
+    store_dir, name = os.path.split(path)
+    if is_snapshot_store(store_dir):
+        sha256 = get_store(store_dir).current(name)
+        if sha256 is None:
+            raise FileNotFoundError(f"No snapshot of {name} in {store_dir}!")
+        return sha256
+    return hash_file(path)
+
+# Write a raw source file via a temporary file, so a failed fetch doesn't clobber the previous version.
+# If the folder is a snapshot store, the result is stored as a new snapshot rather than as a plain file:
+@contextmanager
+def write_source(path, encoding='utf-8', newline=None):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding=encoding, newline=newline) as f:
+        yield f
+    store_dir, name = os.path.split(path)
+    if is_snapshot_store(store_dir):
+        get_store(store_dir).add_file(name, tmp_path)
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+
+
+# Main for CLI
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # Set up a simpler argument parser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('action', choices=['add', 'list', 'cat'])
+    parser.add_argument('store_dir')
+    parser.add_argument('items', nargs='*', help="For 'add', the files to store (under their file names). For 'cat', the source name.")
+    parser.add_argument('--sha256', help="For 'cat', output this snapshot rather than the current one.")
+
+    args = parser.parse_args()
+
+    store = SnapshotStore(args.store_dir)
+    if args.action == 'add':
+        for path in args.items:
+            store.add_file(os.path.basename(path), path)
+        # Make sure there's a manifest, even if nothing was added:
+        store.save()
+    elif args.action == 'list':
+        for name in store.names():
+            entry = store.manifest['history'][name][-1]
+            print(f"{name}\t{entry['sha256']}\t{entry['size']}\t{entry['compressed_size']}\t{entry['added']}\t{len(store.manifest['history'][name])} snapshots")
+    elif args.action == 'cat':
+        if len(args.items) != 1:
+            parser.error("Give the name of the source to output.")
+        with store.open(args.items[0], args.sha256, newline='') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+                sys.stdout.write(chunk)
@@ -1,30 +1,53 @@
 import logging
-import requests
 import lxml.html
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .httpcache import get_http_cache
 
 logger = logging.getLogger(__name__)
 
-# Helper function to get PDF URLs:
-def download_and_extract_pdf_url(url):
-    try:
-        # Download the web page
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for bad responses
+# Landing pages rarely change, so can be cached for a while:
+LANDING_PAGE_TTL = 30*24*60*60
+# Default number of worker threads for resolving landing pages:
+DEFAULT_RESOLVER_WORKERS = 8
+
+# Download a landing page (via the shared, pooled HTTP cache) and pull out the citation_pdf_url, raising an exception if that fails:
+def resolve_pdf_url(url, ttl=LANDING_PAGE_TTL):
+    # Download the web page
+    response = get_http_cache().get(url, ttl=ttl, allow_redirects=True)
+    response.raise_for_status()  # Raise an exception for bad responses
 
-        # Parse the HTML content using lxml
-        root = lxml.html.fromstring(response.content)
+    # Parse the HTML content using lxml
+    root = lxml.html.fromstring(response.content)
 
-        # Find the meta tag with name 'citation_pdf_url'
-        pdf_url_tag = root.xpath('//meta[@name="citation_pdf_url"]')
+    # Find the meta tag with name 'citation_pdf_url' (only in the head, as pages can embed other items' metadata in the body)
+    pdf_url_tag = root.xpath('/html/head/meta[@name="citation_pdf_url"]')
 
-        if pdf_url_tag:
-            # Extract the content attribute value
-            pdf_url = pdf_url_tag[0].get('content')
-            return pdf_url
-        else:
-            logger.warn("No citation_pdf_url metadata tag found.")
-            return None
+    if pdf_url_tag:
+        # Extract the content attribute value
+        return pdf_url_tag[0].get('content')
+    else:
+        raise Exception(f"No citation_pdf_url metadata tag found at {url}.")
 
+# Helper function to get PDF URLs:
+def download_and_extract_pdf_url(url):
+    try:
+        return resolve_pdf_url(url)
     except Exception as e:
         logger.error(f"Error: {e}")
-        return None
\ No newline at end of file
+        return None
+
+# Apply a function to a stream of items using a pool of worker threads, yielding (item, result) pairs in the original order.
+# At most `max_pending` items are in flight at once, so the input can be a lazy stream (e.g. an OAI-PMH harvest):
+def ordered_pool_map(func, items, workers=DEFAULT_RESOLVER_WORKERS, max_pending=None):
+    max_pending = max_pending or workers * 4
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= max_pending:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
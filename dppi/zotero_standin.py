@@ -0,0 +1,217 @@
+import io
+import sys
+import copy
+import json
+import shutil
+import logging
+import argparse
+import tempfile
+import importlib
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pyzotero import zotero
+from .httpcache import HttpCache, set_http_cache
+from .snapshots import open_source
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8003
+# The fields the fetcher adds to the items, which the real APIs don't return:
+FETCHER_FIELDS = ['osf_id', 'landing_page', 'osf_files']
+
+# A Zotero group library, held in memory, as loaded from a dump written by the fetcher (with the OSF file listings
+# recorded there too). It can be changed, bumping the library version as Zotero does, to try out incremental syncs:
+class StandinLibrary:
+    def __init__(self, items):
+        self.lock = threading.Lock()
+        self.items = {}
+        self.osf_files = {}
+        self.deleted = {}
+        self.version = 0
+        for item in items:
+            item = copy.deepcopy(item)
+            item.pop('publication_type', None)
+            data = item['data']
+            if 'osf_id' in data:
+                self.osf_files[data['osf_id']] = data['osf_files']
+            for field in FETCHER_FIELDS:
+                data.pop(field, None)
+            self.items[item['key']] = item
+            self.version = max(self.version, item['version'])
+
+    # Change an item (with a function that modifies its data), giving it the new library version:
+    def change(self, key, modify):
+        with self.lock:
+            self.version += 1
+            item = self.items[key]
+            modify(item['data'])
+            item['version'] = item['data']['version'] = self.version
+
+    def delete(self, key):
+        with self.lock:
+            self.version += 1
+            del self.items[key]
+            self.deleted[key] = self.version
+
+    # Items are in a collection if they're filed there, or if their parent item is:
+    def in_collection(self, item, collection_key):
+        data = item['data']
+        if 'parentItem' in data:
+            parent = self.items.get(data['parentItem'])
+            data = parent['data'] if parent else {}
+        return collection_key in data.get('collections', [])
+
+    # Listed most recently modified first, as Zotero does by default:
+    def list_items(self, collection_key=None, since=0):
+        with self.lock:
+            items = [
+                item for item in self.items.values()
+                if item['version'] > since and (collection_key is None or self.in_collection(item, collection_key))
+            ]
+        return sorted(items, key=lambda item: -item['version'])
+
+    def list_deleted(self, since=0):
+        with self.lock:
+            return [key for key, version in self.deleted.items() if version > since]
+
+# Serves the parts of the Zotero API the fetcher uses (the library and collection item listings, with paging and 'since',
+# and the deleted items), and the OSF file listings under /osf:
+class StandinHandler(BaseHTTPRequestHandler):
+    library = None
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        parts = url.path.strip('/').split('/')
+        since = int(params.get('since', 0))
+        if parts[:1] == ['osf'] and len(parts) >= 3 and parts[1] == 'nodes':
+            listing = self.library.osf_files.get(parts[2])
+            if listing is None:
+                self.send_error(404)
+            else:
+                self.send_json(listing)
+        elif parts[-1] == 'deleted':
+            self.send_json({ 'collections': [], 'searches': [], 'items': self.library.list_deleted(since), 'tags': [], 'settings': [] })
+        elif parts[-1] == 'items':
+            collection_key = parts[-2] if len(parts) >= 3 and parts[-3] == 'collections' else None
+            self.send_page(url, params, self.library.list_items(collection_key, since))
+        else:
+            self.send_error(404)
+
+    def send_page(self, url, params, items):
+        start = int(params.get('start', 0))
+        limit = int(params.get('limit', 25))
+        links = None
+        if start + limit < len(items):
+            next_params = urllib.parse.urlencode({ **params, 'start': start + limit, 'limit': limit })
+            links = f'<http://{self.headers["Host"]}{url.path}?{next_params}>; rel="next"'
+        self.send_json(items[start:start + limit], links, len(items))
+
+    def send_json(self, data, links=None, total=None):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Last-Modified-Version', str(self.library.version))
+        if total is not None:
+            self.send_header('Total-Results', str(total))
+        if links:
+            self.send_header('Link', links)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+def load_library(dump_path):
+    with open_source(dump_path) as f:
+        return StandinLibrary(json.loads(line) for line in f)
+
+def start_server(library, port=DEFAULT_PORT):
+    handler = type('LibraryHandler', (StandinHandler,), { 'library': library })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def dump_items(fetcher, store):
+    f = io.StringIO()
+    fetcher.write_items(store, f)
+    return f.getvalue()
+
+# Sync a fresh item store from a stand-in library served from a dump, then make some changes (an edited item, a changed
+# attachment, a deleted item, an item moved to another collection and one filed under two), and check that an incremental
+# sync only fetches the changed attachment's OSF listing, and ends up writing exactly what a full sync of the changed
+# library does:
+def check(dump_path):
+    fetcher = importlib.import_module('dppi.fetcher-zotero')
+    library = load_library(dump_path)
+    server = start_server(library, 0)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    fetcher.OSF_API_URL = f"{base}/osf"
+    cache_dir = tempfile.mkdtemp(prefix='dppi-zotero-check-')
+    cache = set_http_cache(HttpCache(cache_dir=cache_dir))
+    problems = []
+    try:
+        def sync(store):
+            zot = zotero.Zotero(fetcher.library_id, fetcher.library_type, None)
+            zot.endpoint = base
+            return fetcher.sync_store(zot, store)
+
+        store = sync(fetcher.empty_store())
+        first = dump_items(fetcher, store)
+        if len(first.splitlines()) != len(library.items):
+            problems.append(f"The full sync wrote {len(first.splitlines())} items, not {len(library.items)}")
+
+        parents = [item for item in library.items.values() if item['data']['itemType'] != 'attachment']
+        attachment = next(item for item in library.items.values() if item['data']['itemType'] == 'attachment' and item['data']['url'].startswith('https://osf.io/'))
+        edited, deleted, moved, double = parents[0], parents[1], parents[2], parents[3]
+        library.change(edited['key'], lambda data: data.update(title=f"{data['title']} (edited)"))
+        library.change(attachment['key'], lambda data: data.update(dateModified='2099-01-01T00:00:00Z'))
+        for key in [deleted['key']] + [item['key'] for item in library.items.values() if item['data'].get('parentItem') == deleted['key']]:
+            library.delete(key)
+        library.change(moved['key'], lambda data: data.update(collections=[fetcher.kinds['Workshop']]))
+        library.change(double['key'], lambda data: data.update(collections=[fetcher.kinds['Poster'], fetcher.kinds['Long Paper']]))
+
+        lookups = cache.hits + cache.revalidated + cache.misses
+        store = sync(store)
+        lookups = cache.hits + cache.revalidated + cache.misses - lookups
+        if lookups != 1:
+            problems.append(f"The incremental sync looked up {lookups} OSF listings, not 1")
+        if store['items'][double['key']]['publication_type'] != 'Long Paper':
+            problems.append(f"The item filed under two kinds is a {store['items'][double['key']]['publication_type']}, not a Long Paper")
+        if dump_items(fetcher, store) != dump_items(fetcher, sync(fetcher.empty_store())):
+            problems.append("The incremental sync wrote something different from a full sync")
+    finally:
+        server.shutdown()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    for problem in problems:
+        logger.error(problem)
+    logger.info(f"Checked the incremental sync of {len(library.items)} items, and found {len(problems)} problems.")
+    return not problems
+
+
+# Main for CLI
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # Set up a simpler argument parser:
+    parser = argparse.ArgumentParser(description="Local stand-in for the Zotero and OSF APIs, serving a library from a Zotero dump, for trying out dppi.fetcher-zotero offline.")
+    subparsers = parser.add_subparsers(dest='action', required=True)
+    serve_parser = subparsers.add_parser('serve', help="Serve the library, e.g. for: python -m dppi.fetcher-zotero --zotero-endpoint http://localhost:8003 --osf-api http://localhost:8003/osf ...")
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument('dump_jsonl')
+    check_parser = subparsers.add_parser('check', help="Check a full and an incremental sync against the library, after some changes to it.")
+    check_parser.add_argument('dump_jsonl')
+
+    args = parser.parse_args()
+
+    if args.action == 'serve':
+        library = load_library(args.dump_jsonl)
+        handler = type('LibraryHandler', (StandinHandler,), { 'library': library })
+        server = ThreadingHTTPServer(('127.0.0.1', args.port), handler)
+        logger.info(f"Serving {len(library.items)} items on http://127.0.0.1:{args.port}/ and their OSF listings on http://127.0.0.1:{args.port}/osf")
+        server.serve_forever()
+    elif args.action == 'check':
+        if not check(args.dump_jsonl):
+            sys.exit(1)
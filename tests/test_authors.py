@@ -0,0 +1,89 @@
+import os
+from dppi.models import Publication
+from dppi.authors import AuthorIndex, name_parts, forenames_compatible, merge_forenames, get_creator_names
+
+def test_name_parts_ignore_case_accents_and_punctuation():
+    assert name_parts("José A. Borbinha") == ("borbinha", ["jose", "a"])
+    assert name_parts("") == ("", [])
+
+def test_forenames_compatible_with_initials():
+    assert forenames_compatible(["p"], ["priscilla"])
+    assert forenames_compatible(["priscilla"], ["priscilla", "j"])
+    assert not forenames_compatible(["paul"], ["priscilla"])
+
+def test_merge_forenames_keeps_the_fullest_form():
+    assert merge_forenames(["p", "j"], ["paul"]) == ["paul", "j"]
+
+def test_variants_map_to_the_same_author():
+    index = AuthorIndex()
+    author_id = index.identify("Priscilla Caplan")
+    assert index.identify("P. Caplan") == author_id
+    assert index.identify("Priscilla Cáplan") == author_id
+    assert index.identify("Paul Caplan") != author_id
+    assert index.canonical_name(author_id) == "Priscilla Cáplan"
+
+def test_forenames_are_checked_against_every_variant():
+    index = AuthorIndex()
+    author_id = index.identify("P. J. Smith")
+    assert index.identify("Paul Smith") == author_id
+    # Compatible with 'P. J.', but not with 'Paul':
+    assert index.identify("Peter Smith") != author_id
+
+def test_ambiguous_names_get_a_new_author():
+    index = AuthorIndex()
+    paul = index.identify("Paul Smith")
+    peter = index.identify("Peter Smith")
+    other = index.identify("P. Smith")
+    assert other not in (paul, peter)
+    # And from then on, that exact variant goes to the same place:
+    assert index.identify("P. Smith") == other
+
+def test_institutions_are_recorded_but_not_used_for_matching():
+    index = AuthorIndex()
+    author_id = index.identify("Jane Doe", ["University A"])
+    assert index.identify("J. Doe", ["University B"]) == author_id
+    assert index.authors[author_id]['institutions'] == {"University A", "University B"}
+
+def test_save_and_load_keep_the_ids(tmp_path):
+    path = str(tmp_path / "authors.json")
+    index = AuthorIndex()
+    ids = [index.identify(name) for name in ["Priscilla Caplan", "Paul Smith", "Peter Smith", "P. Smith"]]
+    index.save(path)
+    loaded = AuthorIndex.load(path)
+    assert [loaded.identify(name) for name in ["Priscilla Caplan", "Paul Smith", "Peter Smith", "P. Smith"]] == ids
+    assert loaded.identify("P. Caplan") == ids[0]
+    assert loaded.identify("Anne New") not in ids
+
+def test_save_only_rewrites_when_changed(tmp_path):
+    path = str(tmp_path / "authors.json")
+    index = AuthorIndex()
+    index.identify("Priscilla Caplan")
+    index.save(path)
+    os.utime(path, (0, 0))
+    index.save(path)
+    assert os.path.getmtime(path) == 0
+    index.identify("Anne New")
+    index.save(path)
+    assert os.path.getmtime(path) != 0
+
+def test_the_same_names_in_the_same_order_give_the_same_index(tmp_path):
+    names = ["P. Smith", "Paul Smith", "Priscilla Caplan", "Peter Smith", "P. Caplan", "José Borbinha", "Jose Borbinha"]
+    contents = []
+    for run in range(2):
+        index = AuthorIndex()
+        for name in names:
+            index.identify(name)
+        path = str(tmp_path / f"authors-{run}.json")
+        index.save(path)
+        with open(path, 'rb') as f:
+            contents.append(f.read())
+    assert contents[0] == contents[1]
+
+def test_apply_and_creator_names():
+    index = AuthorIndex()
+    index.identify("Priscilla Caplan")
+    pub = Publication(source_name="test", year=2020, title="A Paper", language="en", creators=["P. Caplan", "Anne New"], institutions=[], size=None)
+    index.apply(pub)
+    assert len(pub.creator_ids) == 2
+    assert get_creator_names(pub, index) == ["Priscilla Caplan", "Anne New"]
+    assert get_creator_names(pub) == ["P. Caplan", "Anne New"]
@@ -0,0 +1,86 @@
+from dppi.models import Publication
+from dppi.dedup import canon_title, find_clusters, merge_cluster, merge_groups, is_proceedings, Deduplicator
+
+def pub(title, creators=("Jane Smith",), year=2020, type='paper', document_url=None, **links):
+    return Publication(
+        source_name="test", year=year, title=title, language="en", creators=list(creators),
+        institutions=[], size=None, type=type, document_url=document_url, **links,
+    )
+
+def test_canon_title_ignores_case_accents_and_punctuation():
+    assert canon_title("Préservation:  The  Next Step!") == "preservation the next step"
+
+def test_similar_titles_with_shared_creators_are_clustered():
+    pubs = [
+        pub("The Community-driven Evolution of the Archivematica Project", ["Peter Van Garderen", "Courtney Mumma"]),
+        pub("The Community-Driven Evolution of the Archivematica Project", ["Peter Van Garderen", "Courtney Mumma"]),
+        pub("Emulation as a Service for Research Data", ["Klaus Rechert"]),
+    ]
+    clusters, links = find_clusters(pubs)
+    assert clusters == [[0, 1]]
+    assert links[(0, 1)] == 1.0
+
+def test_different_works_by_the_same_creators_are_not_clustered():
+    pubs = [
+        pub("Preservation Planning for Emerging Formats", ["Jane Smith"]),
+        pub("Web Archiving at Scale in National Libraries", ["Jane Smith"]),
+    ]
+    assert find_clusters(pubs) == ([], {})
+
+def test_similar_titles_with_different_creators_are_not_clustered():
+    pubs = [
+        pub("Digital Preservation Storage Criteria", ["Alice Brown", "Bob Green"]),
+        pub("Digital Preservation Storage Criteria", ["Carol White", "Dan Black"]),
+    ]
+    assert find_clusters(pubs)[0] == []
+
+def test_merge_fills_missing_links_without_moving_documents():
+    primary = pub("A Paper", document_url="https://example.org/a.pdf")
+    other = pub("A Paper", document_url="https://example.org/a.pdf", stream_url="https://example.org/video", slides_url="https://example.org/slides")
+    merged = merge_cluster([primary, other])
+    assert merged is primary
+    assert merged.document_url == "https://example.org/a.pdf"
+    assert merged.stream_url == "https://example.org/video"
+    assert merged.slides_url == "https://example.org/slides"
+
+def test_only_copies_of_the_same_type_and_document_are_merged():
+    poster = pub("A Study of Theses", type='poster', document_url="https://example.org/poster.pdf")
+    paper = pub("A Study of Theses", type='paper', document_url="https://example.org/paper.pdf")
+    upload = pub("A Study of Theses", type='paper', document_url="https://example.org/paper-2.pdf")
+    copy = pub("A Study of Theses", type='paper')
+    assert merge_groups([poster, paper, upload, copy]) == [[poster], [paper, copy], [upload]]
+
+def test_deduplicator_reports_without_merging_by_default():
+    pubs = [pub("A Study of Theses", type='poster'), pub("A Study of Theses", type='paper'), pub("Something Else Entirely")]
+    dedup = Deduplicator(merge=False)
+    assert list(dedup.process(pubs)) == pubs
+    assert len(dedup.clusters) == 1
+    assert all(record['kept'] for record in dedup.clusters[0]['records'])
+
+def test_deduplicator_merges_copies_and_keeps_the_poster_and_paper_apart():
+    poster = pub("A Study of Theses", type='poster', document_url="https://example.org/poster.pdf")
+    paper = pub("A Study of Theses", type='paper', document_url="https://example.org/paper.pdf")
+    copy = pub("A Study of Theses", type='paper', stream_url="https://example.org/video")
+    dedup = Deduplicator()
+    result = list(dedup.process([poster, paper, copy]))
+    assert result == [poster, paper]
+    assert paper.stream_url == "https://example.org/video"
+    assert poster.slides_url is None
+    assert [record['kept'] for record in dedup.clusters[0]['records']] == [True, True, False]
+
+def test_clusters_are_only_found_within_a_year():
+    pubs = [pub("A Study of Theses", year=2019), pub("A Study of Theses", year=2020)]
+    dedup = Deduplicator()
+    assert len(list(dedup.process(pubs))) == 2
+    assert dedup.clusters == []
+
+def test_proceedings_volumes_are_listed_and_not_clustered():
+    volume = pub("iPRES 2012: Proceedings of the 9th International Conference on Preservation of Digital Objects", creators=[])
+    labelled = pub("8th International Conference on Preservation of Digital Objects", creators=[], type='proceedings')
+    assert is_proceedings(volume) and is_proceedings(labelled)
+    assert not is_proceedings(pub("Proceedings as a Preservation Problem"))
+    dedup = Deduplicator()
+    pubs = [volume, labelled, pub("A Paper")]
+    assert list(dedup.process(pubs)) == pubs
+    assert [p['title'] for p in dedup.report()['proceedings']] == [volume.title, labelled.title]
+    assert dedup.report()['proceedings'][0]['year_records'] == 1
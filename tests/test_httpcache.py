@@ -0,0 +1,117 @@
+import os
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from dppi.httpcache import HttpCache, CacheMiss, make_session
+
+# A local server that returns a 100-byte body with an ETag (or a 404 for /missing), honouring If-None-Match except for
+# /changing, and records the requests it gets:
+class Handler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.respond()
+
+    def respond(self):
+        self.requests.append((self.command, self.path, dict(self.headers)))
+        if self.path == '/missing':
+            self.send_error(404)
+            return
+        if self.path != '/changing' and self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = b'x' * 100
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    Handler.requests = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, kwargs={ 'poll_interval': 0.01 }, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+def make_cache(tmp_path, **kwargs):
+    return HttpCache(cache_dir=str(tmp_path / 'cache'), session=make_session(retries=0), **kwargs)
+
+def test_fresh_responses_come_from_the_cache(tmp_path, server):
+    cache = make_cache(tmp_path)
+    first = cache.get(f"{server}/a")
+    second = cache.get(f"{server}/a")
+    assert not first.from_cache and second.from_cache
+    assert second.content == first.content
+    assert len(Handler.requests) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_stale_responses_are_revalidated(tmp_path, server):
+    cache = make_cache(tmp_path)
+    cache.get(f"{server}/a")
+    response = cache.get(f"{server}/a", ttl=0)
+    assert response.from_cache and response.content == b'x' * 100
+    assert Handler.requests[1][2]['If-None-Match'] == '"v1"'
+    assert cache.revalidated == 1
+
+def test_posts_are_keyed_on_the_body_and_not_conditional(tmp_path, server):
+    cache = make_cache(tmp_path)
+    cache.post(f"{server}/search", data={ 'start': 0 })
+    cache.post(f"{server}/search", data={ 'start': 10 })
+    assert cache.post(f"{server}/search", data={ 'start': 0 }).from_cache
+    assert len(Handler.requests) == 2
+    cache.post(f"{server}/search", data={ 'start': 0 }, ttl=0)
+    assert 'If-None-Match' not in Handler.requests[2][2]
+
+def test_errors_are_not_cached(tmp_path, server):
+    cache = make_cache(tmp_path)
+    assert cache.get(f"{server}/missing").status_code == 404
+    cache.get(f"{server}/missing")
+    assert len(Handler.requests) == 2
+
+def test_offline_only_uses_the_cache(tmp_path, server):
+    make_cache(tmp_path).get(f"{server}/a")
+    offline = make_cache(tmp_path, offline=True)
+    assert offline.get(f"{server}/a", ttl=0).from_cache
+    with pytest.raises(CacheMiss):
+        offline.get(f"{server}/b")
+    assert len(Handler.requests) == 1
+
+def test_hits_touch_the_body_without_rewriting_the_metadata(tmp_path, server):
+    cache = make_cache(tmp_path)
+    cache.get(f"{server}/a")
+    key = cache._key('GET', f"{server}/a", None, None)
+    meta_path, body_path = cache._paths(key)
+    os.utime(meta_path, (0, 0))
+    os.utime(body_path, (0, 0))
+    cache.get(f"{server}/a")
+    assert os.path.getmtime(meta_path) == 0
+    assert os.path.getmtime(body_path) > 0
+
+def test_replacing_an_entry_does_not_grow_the_total(tmp_path, server):
+    cache = make_cache(tmp_path)
+    cache.total_size = 0
+    cache.get(f"{server}/changing")
+    cache.get(f"{server}/changing", ttl=0)
+    assert cache.misses == 2
+    assert cache.total_size == 100
+
+def test_least_recently_used_entries_are_evicted(tmp_path, server):
+    cache = make_cache(tmp_path, max_size=350)
+    for name, used in [('a', 100), ('b', 200), ('c', 300)]:
+        cache.get(f"{server}/{name}")
+        os.utime(cache._paths(cache._key('GET', f"{server}/{name}", None, None))[1], (used, used))
+    # Using 'a' makes 'b' the least recently used:
+    cache.get(f"{server}/a")
+    cache.get(f"{server}/d")
+    assert sorted(meta['url'].rsplit('/', 1)[1] for meta in cache._list_entries().values()) == ['a', 'c', 'd']
+    assert cache.total_size == 300